@@ -0,0 +1,100 @@
+# Play count aggregates maintained incrementally by the ETL pipeline
+
+from backends import default_backend
+from sql_queries import aggregate_queries, aggregate_delete
+
+def play_deltas(df):
+    '''
+    Counts plays per aggregate key in a dataframe of newly loaded plays
+
+    Args:
+        df: dataframe of trackplays rows, with start_time,
+            tier, track_id and user_id columns
+
+    Returns:
+        dict of lists of row tuples, keyed on aggregate table
+    '''
+    df = df[df['start_time'].notna()]
+    hour = df['start_time'].dt.floor('h')
+    day = df['start_time'].dt.date
+
+    deltas = {}
+    # The tier may be categorical, grouped on its values so that
+    # only the observed hour and tier pairs are counted
+    counts = df.groupby([hour, df['tier'].astype(object).fillna('')]).size()
+    deltas['plays_by_hour_tier'] = [(h, t, n) for (h, t), n in counts.items()]
+
+    played = df['track_id'].notna()
+    counts = df[played].groupby([df.loc[played, 'track_id'], day[played]]).size()
+    deltas['plays_by_track_day'] = [(t, d, n) for (t, d), n in counts.items()]
+
+    counts = df.groupby([df['user_id'].astype(int), day]).size()
+    deltas['plays_by_user_day'] = [(u, d, n) for (u, d), n in counts.items()]
+
+    # Python scalars, so that every driver can bind them
+    return {table: [tuple(v.item() if hasattr(v, 'item') else v for v in row) for row in rows]
+            for table, rows in deltas.items()}
+
+
+def apply_play_deltas(cur, df, backend=None):
+    '''
+    Adds the plays of newly loaded trackplays rows to the
+    aggregate tables. Run in the same transaction as the load,
+    only for rows that were actually inserted
+
+    Args:
+        cur: cursor to musicstream database
+        df: dataframe of the inserted trackplays rows
+        backend: storage Backend, Postgres if not given
+
+    Returns:
+        number of aggregate rows updated
+    '''
+    backend = backend or default_backend
+    if df.empty:
+        return 0
+
+    updated = 0
+    for table, rows in play_deltas(df).items():
+        backend.execute_values(cur, aggregate_queries[table][1], rows)
+        updated += len(rows)
+
+    return updated
+
+
+def create_aggregate_tables(cur, backend=None):
+    '''
+    Creates the aggregate tables if they do not exist yet
+
+    Args:
+        cur: cursor to musicstream database
+        backend: storage Backend, Postgres if not given
+
+    Returns:
+        None
+    '''
+    backend = backend or default_backend
+    for create, upsert, rebuild in aggregate_queries.values():
+        cur.execute(backend.translate(create))
+
+
+def rebuild_aggregates(cur, conn, backend=None):
+    '''
+    Recomputes the aggregate tables from the trackplays table,
+    in one transaction so readers never see them empty
+
+    Args:
+        cur: cursor to musicstream database
+        conn: connection to musicstream database
+        backend: storage Backend, Postgres if not given
+
+    Returns:
+        None
+    '''
+    backend = backend or default_backend
+    create_aggregate_tables(cur, backend)
+    for table, (create, upsert, rebuild) in aggregate_queries.items():
+        print(f'Rebuilding {table}')
+        cur.execute(aggregate_delete.format(table))
+        cur.execute(backend.translate(rebuild))
+    conn.commit()
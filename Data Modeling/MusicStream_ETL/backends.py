@@ -0,0 +1,363 @@
+# Storage backends of the MusicStream database
+# Each backend connects to its engine and bulk loads dataframes
+# with the engine's native path
+
+import os
+import re
+import sqlite3
+from io import StringIO
+import numpy as np
+import pandas as pd
+from metrics import counting_cursor
+from sql_queries import bulk_load_queries, stage_truncate, stage_copy, table_columns, \
+    table_inserts, relaxed_commit
+
+class Backend:
+    '''
+    Base class of the storage backends. The schema and queries in
+    sql_queries are written for Postgres, backends translate them
+    where their engine differs
+
+    Attributes:
+        name: backend name, as passed to --backend
+        database: connection string or database file
+        foreign_keys: whether foreign keys can be added to
+            existing tables (ALTER TABLE ... ADD CONSTRAINT)
+        partitioning: whether trackplays can be range partitioned
+            on start_time (create_tables.py --partition)
+    '''
+    name = None
+    default_database = None
+    foreign_keys = False
+    partitioning = False
+    # Regular expressions of Postgres types and functions,
+    # and their replacements in this engine
+    rewrites = {}
+    # Query parameter placeholder
+    placeholder = '%s'
+
+    def __init__(self, database=None):
+        self.database = database or self.default_database
+
+    def connect(self):
+        '''
+        Connects to the MusicStream database
+
+        Returns:
+            connection
+        '''
+        raise NotImplementedError
+
+    def cursor(self, conn):
+        '''
+        Gets a cursor of a connection returned by connect
+
+        Args:
+            conn: connection to musicstream database
+
+        Returns:
+            cursor
+        '''
+        return conn.cursor()
+
+    def create_database(self):
+        '''
+        Creates an empty MusicStream database, dropping an existing one
+
+        Returns:
+            tuple of cursor and connection to the new database
+        '''
+        raise NotImplementedError
+
+    def translate(self, query):
+        '''
+        Translates a query of sql_queries to this engine
+
+        Args:
+            query: query string
+
+        Returns:
+            query string
+        '''
+        for pattern, replacement in self.rewrites.items():
+            query = re.sub(pattern, replacement, query)
+        if self.placeholder != '%s':
+            query = query.replace('%s', self.placeholder)
+        return query
+
+    def load_df(self, cur, table, df, returning=None):
+        '''
+        Bulk loads dataframe rows into a table, skipping rows whose
+        primary key is already loaded
+
+        Args:
+            cur: cursor to musicstream database
+            table: name of the target table
+            df: dataframe containing data to load, with columns in
+                the same order as the target table
+            returning: primary key column to return for the
+                rows that were inserted (optional)
+
+        Returns:
+            list of primary keys of the inserted rows if
+            returning is given, else None
+        '''
+        raise NotImplementedError
+
+    def execute_values(self, cur, query, rows):
+        '''
+        Runs a query with a single VALUES %s placeholder for a list of rows
+
+        Args:
+            cur: cursor to musicstream database
+            query: query string
+            rows: list of tuples
+
+        Returns:
+            None
+        '''
+        if not rows:
+            return
+        values = '(' + ', '.join([self.placeholder] * len(rows[0])) + ')'
+        cur.executemany(self.translate(query.replace('VALUES %s', f'VALUES {values}')), rows)
+
+    def relax_commit(self, cur):
+        '''
+        Lets commits return before they are durable, for bulk loads
+
+        Args:
+            cur: cursor to musicstream database
+
+        Returns:
+            None
+        '''
+        raise NotImplementedError(f'{self.name} backend does not support bulk-load mode')
+
+
+class PostgresBackend(Backend):
+    '''
+    Postgres backend, loading through COPY into staging tables
+    '''
+    name = 'postgres'
+    default_database = 'host=127.0.0.1 dbname=musicstreamdb user=student password=student'
+    foreign_keys = True
+    partitioning = True
+
+    # psycopg2 is imported where it is used, the other
+    # backends do not need it installed
+    def connect(self):
+        import psycopg2
+        return psycopg2.connect(self.database)
+
+    def cursor(self, conn):
+        return conn.cursor(cursor_factory=counting_cursor())
+
+    def create_database(self):
+        import psycopg2
+        # connect to the default database studentdb on the same server
+        dsn = psycopg2.extensions.parse_dsn(self.database)
+        dbname = dsn.pop('dbname')
+        conn = psycopg2.connect(**dict(dsn, dbname='studentdb'))
+        cur = conn.cursor()
+        conn.set_session(autocommit=True)
+
+        # create the MusicStream database with UTF8 encoding
+        cur.execute(f"DROP DATABASE IF EXISTS {dbname}")
+        cur.execute(f"CREATE DATABASE {dbname} WITH encoding 'UTF8' TEMPLATE template0")
+        # template0 used to get a clean db creation
+        conn.close()
+
+        conn = self.connect()
+        return conn.cursor(), conn
+
+    def stage_df(self, cur, table, df):
+        '''
+        Streams dataframe rows into the emptied temporary
+        staging table of a table with COPY
+
+        Args:
+            cur: cursor to musicstream database
+            table: name of the target table
+            df: dataframe containing data to load, with columns in
+                the same order as the target table
+
+        Returns:
+            None
+        '''
+        cur.execute(bulk_load_queries[table][0])
+        cur.execute(stage_truncate.format(table))
+
+        # Write dataframe as CSV to an in-memory buffer, NULLs as \N
+        buf = StringIO()
+        df.to_csv(buf, header=False, index=False, na_rep='\\N')
+        buf.seek(0)
+
+        cur.copy_expert(stage_copy.format(table), buf)
+
+    def load_df(self, cur, table, df, returning=None):
+        # The dataframe is streamed into a temporary staging table with
+        # COPY and then merged into the target table with a single
+        # INSERT ... SELECT ... ON CONFLICT DO NOTHING
+        self.stage_df(cur, table, df)
+        stage_merge = bulk_load_queries[table][1]
+        if returning is None:
+            cur.execute(stage_merge)
+            return None
+        
+        cur.execute(stage_merge.rstrip().rstrip(';') + f' RETURNING {returning}')
+        return [row[0] for row in cur.fetchall()]
+
+    def execute_values(self, cur, query, rows):
+        from psycopg2.extras import execute_values
+        execute_values(cur, query, rows)
+
+    def relax_commit(self, cur):
+        cur.execute(relaxed_commit)
+
+
+# NumPy scalars and pandas timestamps are bound as Python values
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.int32, int)
+sqlite3.register_adapter(pd.Timestamp, lambda ts: ts.isoformat(sep=' '))
+
+# Bound parameters per query, within SQLite's default limit
+SQLITE_MAX_PARAMS = 500
+
+class SQLiteBackend(Backend):
+    '''
+    SQLite backend, loading with executemany in the running transaction
+    '''
+    name = 'sqlite'
+    default_database = 'musicstream.sqlite'
+    rewrites = {r'\bjsonb\b': 'text', r'\bnow\(\)': 'CURRENT_TIMESTAMP',
+                r"\bdate_trunc\('hour', (\w+)\)": r"strftime('%Y-%m-%d %H:00:00', \1)",
+                r'\b([\w.]+)::date\b': r'date(\1)'}
+    placeholder = '?'
+
+    def connect(self):
+        conn = sqlite3.connect(self.database)
+        # Commits append to the write-ahead log instead of
+        # rewriting pages through a rollback journal
+        conn.execute('PRAGMA journal_mode = WAL')
+        return conn
+
+    def create_database(self):
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.database + suffix):
+                os.remove(self.database + suffix)
+        conn = self.connect()
+        return conn.cursor(), conn
+
+    def load_df(self, cur, table, df, returning=None):
+        # executemany discards RETURNING rows, so the keys
+        # already loaded are looked up first
+        if returning is not None:
+            keys = df[returning]
+            existing = set()
+            for i in range(0, len(keys), SQLITE_MAX_PARAMS):
+                chunk = keys.iloc[i:i + SQLITE_MAX_PARAMS].tolist()
+                cur.execute(f'SELECT {returning} FROM {table} WHERE {returning} IN '
+                            f'({", ".join("?" * len(chunk))})', chunk)
+                existing.update(row[0] for row in cur.fetchall())
+            inserted = keys[~keys.isin(existing) & ~keys.duplicated()].tolist()
+        
+        rows = df.astype(object).where(df.notna(), None)
+        cur.executemany(self.translate(table_inserts[table]),
+                        rows.itertuples(index=False, name=None))
+        
+        return inserted if returning is not None else None
+
+
+class _DuckDBConnection:
+    '''
+    DB-API style wrapper of a DuckDB connection. DuckDB runs each
+    statement in its own transaction unless one is begun, so a
+    transaction is kept open and commit starts the next one
+    '''
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._conn.begin()
+
+    def cursor(self):
+        # DuckDB cursors are separate connections with their own
+        # transactions, statements run on the connection itself
+        return self._conn
+
+    def commit(self):
+        self._conn.commit()
+        self._conn.begin()
+
+    def rollback(self):
+        self._conn.rollback()
+        self._conn.begin()
+
+    def close(self):
+        self._conn.close()
+
+
+class DuckDBBackend(Backend):
+    '''
+    DuckDB backend, loading by scanning the dataframe in place
+    '''
+    name = 'duckdb'
+    default_database = 'musicstream.duckdb'
+    # DuckDB numeric is a fixed point DECIMAL(18,3)
+    rewrites = {r'\bnumeric\b': 'double', r'\bjsonb\b': 'text'}
+    placeholder = '?'
+
+    def connect(self):
+        import duckdb
+        return _DuckDBConnection(duckdb.connect(self.database))
+
+    def create_database(self):
+        for suffix in ['', '.wal']:
+            if os.path.exists(self.database + suffix):
+                os.remove(self.database + suffix)
+        conn = self.connect()
+        return conn.cursor(), conn
+
+    def load_df(self, cur, table, df, returning=None):
+        # The dataframe is registered as the staging table and
+        # merged with the same query as in Postgres
+        stage_create, stage_merge = bulk_load_queries[table]
+        if returning is not None:
+            stage_merge = stage_merge.rstrip().rstrip(';') + f' RETURNING {returning}'
+        cur.register(f'{table}_stage', df.set_axis(table_columns[table], axis=1))
+        try:
+            cur.execute(stage_merge)
+            if returning is not None:
+                return [row[0] for row in cur.fetchall()]
+        finally:
+            cur.unregister(f'{table}_stage')
+
+    def execute_values(self, cur, query, rows):
+        # One statement over a dataframe of the rows, DuckDB
+        # runs executemany as one statement per row
+        if not rows:
+            return
+        cur.register('values_stage', pd.DataFrame(rows))
+        try:
+            cur.execute(self.translate(query.replace('VALUES %s', 'SELECT * FROM values_stage')))
+        finally:
+            cur.unregister('values_stage')
+
+
+BACKENDS = {backend.name: backend for backend in [PostgresBackend, SQLiteBackend, DuckDBBackend]}
+
+# Backend of callers not given one
+default_backend = PostgresBackend()
+
+def get_backend(name='postgres', database=None):
+    '''
+    Creates a backend by name
+
+    Args:
+        name: backend name, one of BACKENDS
+        database: connection string or database file, the
+            backend's default if not given
+
+    Returns:
+        Backend
+    '''
+    return BACKENDS[name](database)
@@ -0,0 +1,123 @@
+# End-to-end benchmark of the MusicStream ETL pipeline
+# Runs create_tables.py and etl.py against a local Postgres and
+# reports wall time, rows/sec and peak RSS per stage
+
+import os
+import sys
+import json
+import time
+import shlex
+import argparse
+import subprocess
+from backends import BACKENDS, get_backend
+
+ETL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Tables filled by each etl.py stage
+STAGE_TABLES = {'songs': ['artists', 'tracks'],
+                'logs': ['timetb', 'users', 'trackplays']}
+
+def run_stage(name, command):
+    '''
+    Runs one stage as a child process and measures it
+
+    Args:
+        name: stage name
+        command: command line to run
+
+    Returns:
+        dict with wall time (s) and peak RSS (MB) of the stage
+    '''
+    print(f'[{name}] {" ".join(command)}')
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=ETL_DIR, stdout=subprocess.DEVNULL)
+    # wait4 returns the resource usage of this child alone,
+    # including worker processes it has reaped
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+
+    if proc.returncode != 0:
+        raise RuntimeError(f'{name} failed with exit code {proc.returncode}')
+
+    return {'stage': name, 'wall_s': round(wall, 3), 'peak_rss_mb': round(rusage.ru_maxrss / 1024, 1)}
+
+
+def count_rows(backend, tables):
+    '''
+    Counts the rows in the given musicstream tables
+
+    Args:
+        backend: storage Backend of the database
+        tables: list of table names
+
+    Returns:
+        dict of row counts keyed on table
+    '''
+    conn = backend.connect()
+    cur = conn.cursor()
+    counts = {}
+    for table in tables:
+        cur.execute(f'SELECT count(*) FROM {table}')
+        counts[table] = cur.fetchone()[0]
+    conn.close()
+
+    return counts
+
+
+def main():
+    '''
+    Runs the benchmark and prints a report
+
+    Args:
+        None
+
+    Returns:
+        None
+    '''
+    parser = argparse.ArgumentParser(description='Benchmark the MusicStream ETL pipeline')
+    parser.add_argument('--data-dir', default='data',
+                        help='data directory to load, relative to the ETL directory')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='postgres',
+                        help='storage backend to benchmark')
+    parser.add_argument('--database',
+                        help='connection string (postgres) or database file (sqlite, duckdb)')
+    parser.add_argument('--generate', metavar='ARGS',
+                        help='generate data into --data-dir first, with these generate_data.py '
+                             'arguments, e.g. "--songs 10000 --users 1000 --days 30"')
+    parser.add_argument('--etl-args', default='', metavar='ARGS',
+                        help='extra etl.py arguments, e.g. "--workers 4"')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    args = parser.parse_args()
+    etl_args = shlex.split(args.etl_args)
+    backend = get_backend(args.backend, args.database)
+    backend_args = ['--backend', backend.name, '--database', backend.database]
+
+    results = []
+    if args.generate is not None:
+        results.append(run_stage('generate', [sys.executable, 'generate_data.py',
+                                              '--output', args.data_dir] + shlex.split(args.generate)))
+
+    results.append(run_stage('create_tables', [sys.executable, 'create_tables.py'] + backend_args))
+    for phase, tables in STAGE_TABLES.items():
+        result = run_stage(phase, [sys.executable, 'etl.py', '--data-dir', args.data_dir,
+                                   '--phase', phase] + backend_args + etl_args)
+        result['rows'] = count_rows(backend, tables)
+        total = sum(result['rows'].values())
+        result['rows_per_s'] = round(total / result['wall_s'], 1)
+        results.append(result)
+
+    print(f'\n{"stage":<15}{"wall s":>10}{"rows":>12}{"rows/s":>12}{"peak RSS MB":>14}')
+    for result in results:
+        rows = sum(result.get('rows', {}).values())
+        print(f'{result["stage"]:<15}{result["wall_s"]:>10.2f}{rows or "":>12}'
+              f'{result.get("rows_per_s", ""):>12}{result["peak_rss_mb"]:>14.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'data_dir': args.data_dir, 'backend': backend.name,
+                       'etl_args': etl_args, 'stages': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# On-disk columnar cache of parsed song and log data files
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from readers import event_categories
+
+# Bump when the parsed layout of cached files changes
+CACHE_VERSION = 3
+
+# Default size cap of the cache, in bytes
+CACHE_MAX_BYTES = 1 << 30
+
+def _save_column(path, i, column):
+    '''
+    Helper function writing a column as pickle-free .npy files:
+    plain arrays as is, nullable integers as values and null mask,
+    strings and categoricals as int32 codes and unicode values.
+    Raises ValueError for columns holding other objects
+
+    Returns:
+        layout of the column, 'array', 'masked', 'strings' or 'categorical'
+    '''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        kind, codes, values = 'categorical', column.cat.codes.values, column.cat.categories.values
+    elif column.dtype == object:
+        kind = 'strings'
+        codes, values = pd.factorize(column.values)
+    elif str(column.dtype) == 'Int64':
+        np.save(os.path.join(path, f'{i}.npy'), column.to_numpy(dtype=np.int64, na_value=0))
+        np.save(os.path.join(path, f'{i}.mask.npy'), column.isna().values)
+        return 'masked'
+    elif isinstance(column.dtype, np.dtype):
+        np.save(os.path.join(path, f'{i}.npy'), column.values)
+        return 'array'
+    else:
+        raise ValueError(f'column {column.name} has unsupported dtype {column.dtype}')
+
+    if not all(isinstance(value, str) for value in values):
+        raise ValueError(f'column {column.name} holds values other than strings')
+    np.save(os.path.join(path, f'{i}.npy'), codes.astype(np.int32))
+    np.save(os.path.join(path, f'{i}.values.npy'), np.array(values, dtype=str))
+    return kind
+
+
+def _load_column(path, i, field, kind):
+    '''
+    Helper function reading a column written by _save_column.
+    Categoricals of the categorical event fields are coded against
+    the shared event_categories dictionary, as decoded frames are
+
+    Returns:
+        numpy array or pandas array
+    '''
+    data = np.load(os.path.join(path, f'{i}.npy'), allow_pickle=False)
+    if kind == 'array':
+        return data
+    if kind == 'masked':
+        mask = np.load(os.path.join(path, f'{i}.mask.npy'), allow_pickle=False)
+        return pd.arrays.IntegerArray(data, mask)
+
+    values = np.load(os.path.join(path, f'{i}.values.npy'), allow_pickle=False).astype(object)
+    if kind == 'strings':
+        column = np.empty(len(data), dtype=object)
+        column[:] = None
+        present = data >= 0
+        column[present] = values[data[present]]
+        return column
+
+    if field not in event_categories:
+        return pd.Categorical.from_codes(data, categories=values)
+    # Codes of the cached values in the dictionary of this run
+    shared = event_categories.encode(field, list(values)).codes
+    codes = np.full(len(data), -1, dtype=np.int32)
+    present = data >= 0
+    codes[present] = shared[data[present]]
+    return pd.Categorical.from_codes(codes, dtype=event_categories.dtype(field))
+
+
+class ParseCache:
+    '''
+    Cache of parsed data files, stored as NumPy .npy files of each
+    column in a directory named after the file's content hash,
+    read back without unpickling.
+    Entries are evicted least recently used first once the cache
+    grows over its size cap
+
+    Attributes:
+        directory: directory holding the cache entries
+        max_bytes: size cap of the cache
+        hits: number of lookups served from the cache
+        misses: number of lookups not in the cache
+    '''
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total = None
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, datafile, kind, content=None):
+        '''
+        Computes the cache key of a data file from its contents
+
+        Args:
+            datafile: filepath to data file
+            kind: kind of parsed data, e.g. 'events' or 'songs'
+            content: bytes of the file, if already read
+
+        Returns:
+            cache key string
+        '''
+        if content is not None:
+            return f'{kind}-v{CACHE_VERSION}-{hashlib.md5(content).hexdigest()}'
+
+        md5 = hashlib.md5()
+        with open(datafile, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                md5.update(block)
+
+        return f'{kind}-v{CACHE_VERSION}-{md5.hexdigest()}'
+
+    def get(self, key):
+        '''
+        Reads a parsed data file from the cache
+
+        Args:
+            key: cache key from ParseCache.key
+
+        Returns:
+            dataframe, or None if the key is not cached
+        '''
+        path = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(path, 'columns.json')) as f:
+                layout = json.load(f)
+            columns, kinds = layout['columns'], layout['kinds']
+            index = np.load(os.path.join(path, 'index.npy'), allow_pickle=False)
+            data = {column: _load_column(path, i, column, kind)
+                    for i, (column, kind) in enumerate(zip(columns, kinds))}
+
+            # Mark the entry as recently used
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # Missing, evicted concurrently or partially written
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return pd.DataFrame(data, index=index, columns=columns)
+
+    def put(self, key, df):
+        '''
+        Writes a parsed data file to the cache, evicting least
+        recently used entries if the cache is over its size cap
+
+        Args:
+            key: cache key from ParseCache.key
+            df: dataframe of parsed data
+
+        Returns:
+            None
+        '''
+        path = os.path.join(self.directory, key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        os.makedirs(tmp_path, exist_ok=True)
+
+        try:
+            if df.index.dtype == object:
+                raise ValueError('index holds objects')
+            np.save(os.path.join(tmp_path, 'index.npy'), df.index.values)
+            kinds = [_save_column(tmp_path, i, df[column]) for i, column in enumerate(df.columns)]
+        except ValueError:
+            # Columns of mixed values are not cached, they are parsed again
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+            json.dump({'columns': list(df.columns), 'kinds': kinds}, f)
+        size = sum(f.stat().st_size for f in os.scandir(tmp_path))
+
+        # Publish the entry atomically, another process may have won the race
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        # The cache directory is only scanned when the running
+        # total says it may be over its cap
+        if self._total is not None:
+            self._total += size
+        if self._total is None or self._total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        '''
+        Removes least recently used entries until the cache
+        is within its size cap
+
+        Returns:
+            None
+        '''
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or entry.name.endswith('.tmp'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except FileNotFoundError:
+                continue
+            total += size
+
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+        self._total = total
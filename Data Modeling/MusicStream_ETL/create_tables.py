@@ -1,38 +1,52 @@
 # Prerequisite script for creating the MusicStream database and its tables
 # Run before other scripts
 
-import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+import argparse
+from backends import BACKENDS, get_backend, default_backend
+from sql_queries import create_table_queries, drop_table_queries, foreign_keys, \
+    foreign_keys_select, validate_constraint, fkey_violation_queries, unlogged_tables_select, \
+    set_logged, trackplays_table_create, trackplays_partitioned_table_create, \
+    trackplays_partitioning_comment
+from partitions import PARTITION_GRANULARITIES
+from aggregates import rebuild_aggregates
 
-def create_database():
+def create_database(backend=None):
     '''
-    Creates the MusicStream database
+    Creates the MusicStream database, in Postgres unless
+    another storage backend is given
     '''
-    # connect to database studentdb and get cursor
-    conn = psycopg2.connect("host=127.0.0.1 dbname=studentdb user=student password=student")
-    cur = conn.cursor()
-    conn.set_session(autocommit=True)
-    
-    # create the MusicStream database with UTF8 encoding
-    cur.execute("DROP DATABASE IF EXISTS musicstreamdb")
-    cur.execute("CREATE DATABASE musicstreamdb WITH encoding 'UTF8' TEMPLATE template0")
-    # template0 used to get a clean db creation
-    
-    # close default db connection
-    conn.close()
-    
-    # connect to musicstreamdb
-    conn = psycopg2.connect("host=127.0.0.1 dbname=musicstreamdb user=student password=student")
-    cur = conn.cursor()
-    
-    return cur, conn
+    return (backend or default_backend).create_database()
 
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, unlogged=False, backend=None, partition=None):
     '''
-    Create tables defined in sql_queries
+    Create tables defined in sql_queries, optionally as
+    UNLOGGED tables for bulk loading, and trackplays range
+    partitioned on start_time by month or day if partition is given
     '''
+    backend = backend or default_backend
+    # The load manifest, progress, unresolved plays and aggregate tables
+    # are unlogged along with the star schema tables: a crash truncates
+    # them all together, so the files are loaded again instead of being
+    # skipped as loaded into tables that were emptied
     for query in create_table_queries:
+        if partition and query == trackplays_table_create:
+            # Partitions are created by etl.py as plays arrive
+            cur.execute(trackplays_partitioned_table_create)
+            cur.execute(trackplays_partitioning_comment, (partition,))
+            conn.commit()
+            continue
+        if unlogged:
+            query = query.replace('CREATE TABLE', 'CREATE UNLOGGED TABLE', 1)
+        cur.execute(backend.translate(query))
+        conn.commit()
+
+
+def add_foreign_keys(cur, conn):
+    '''
+    Add the foreign keys defined in sql_queries
+    '''
+    for table, name, query in foreign_keys:
         cur.execute(query)
         conn.commit()
     
@@ -44,16 +58,102 @@ def drop_tables(cur, conn):
     for query in drop_table_queries:
         cur.execute(query)
         conn.commit()
+
+
+def finalize_bulk_load(cur, conn):
+    '''
+    Finish a bulk load: make unlogged tables logged, count
+    the rows violating each foreign key and add the foreign keys.
+    Constraints with violations are added NOT VALID, so they
+    are enforced for new rows, and reported
+    
+    Returns:
+        dict of violating row counts keyed on constraint name
+    '''
+    # Referenced tables first, a logged table cannot reference an unlogged one
+    cur.execute(unlogged_tables_select)
+    unlogged = {row[0] for row in cur.fetchall()}
+    star = ['timetb', 'users', 'artists', 'tracks', 'trackplays']
+    for table in star + sorted(unlogged - set(star)):
+        if table in unlogged:
+            print(f'Setting {table} logged')
+            cur.execute(set_logged.format(table))
+            conn.commit()
+    
+    violations = {}
+    for query in fkey_violation_queries:
+        cur.execute(query)
+        names = [column[0] for column in cur.description]
+        violations.update(zip(names, cur.fetchone()))
+    
+    cur.execute(foreign_keys_select)
+    existing = dict(cur.fetchall())
+    
+    for table, name, query in foreign_keys:
+        if existing.get(name):
+            continue
+        if name not in existing:
+            cur.execute(query + ' NOT VALID')
+        if violations[name] == 0:
+            cur.execute(validate_constraint.format(table, name))
+        else:
+            print(f'{name}: {violations[name]} violating rows, constraint left NOT VALID')
+        conn.commit()
     
+    return violations
+
 
 def main():
-    cur, conn = create_database()
+    parser = argparse.ArgumentParser(description='Create the MusicStream database')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='postgres',
+                        help='storage backend of the MusicStream database')
+    parser.add_argument('--database',
+                        help='connection string (postgres) or database file (sqlite, duckdb), '
+                             'the backend default if not given')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='create the tables without foreign keys, which are added '
+                             'once loading is done (etl.py --bulk-load)')
+    parser.add_argument('--unlogged', action='store_true',
+                        help='with --bulk-load, create the tables as UNLOGGED')
+    parser.add_argument('--partition', choices=sorted(PARTITION_GRANULARITIES),
+                        help='range partition trackplays on start_time by month or day')
+    parser.add_argument('--finalize', action='store_true',
+                        help='finish a bulk load of the existing database instead of recreating it')
+    parser.add_argument('--rebuild-aggregates', action='store_true',
+                        help='recompute the play count aggregate tables of the existing database')
+    args = parser.parse_args()
+    backend = get_backend(args.backend, args.database)
+    if (args.bulk_load or args.finalize) and not backend.foreign_keys:
+        parser.error(f'--bulk-load and --finalize are not supported by the {backend.name} backend')
+    if args.partition and not backend.partitioning:
+        parser.error(f'--partition is not supported by the {backend.name} backend')
+    # Foreign keys of a partitioned table cannot be added NOT VALID
+    if args.partition and args.bulk_load:
+        parser.error('--partition cannot be combined with --bulk-load')
+    
+    if args.rebuild_aggregates:
+        conn = backend.connect()
+        rebuild_aggregates(conn.cursor(), conn, backend)
+        conn.close()
+        return
+    
+    if args.finalize:
+        conn = backend.connect()
+        finalize_bulk_load(conn.cursor(), conn)
+        conn.close()
+        return
+    
+    cur, conn = create_database(backend)
     
     drop_tables(cur, conn)
-    create_tables(cur, conn)
+    create_tables(cur, conn, unlogged=args.bulk_load and args.unlogged, backend=backend,
+                  partition=args.partition)
+    # Embedded backends are created without foreign keys
+    if not args.bulk_load and backend.foreign_keys:
+        add_foreign_keys(cur, conn)
     
     conn.close()
     
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
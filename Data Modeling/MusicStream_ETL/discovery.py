@@ -0,0 +1,122 @@
+# Discovery of the data files under the song_data and log_data layouts
+# song_data/X/Y/Z/TRXYZ....json and log_data/YYYY/MM/YYYY-MM-DD-events.json
+
+import os
+import datetime
+from readers import DATA_SUFFIXES
+
+def _entries(directory):
+    '''
+    Helper function listing a directory in name order,
+    empty if it does not exist
+    '''
+    try:
+        with os.scandir(directory) as it:
+            return sorted(it, key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return []
+
+
+def walk_files(directory, keep_dir=None, keep_file=None, parts=()):
+    '''
+    Lazily finds the JSON files of a directory tree in path order, plain
+    or compressed (see DATA_SUFFIXES), skipping whole directories
+    rejected by keep_dir without listing them
+
+    Args:
+        directory: root directory
+        keep_dir: function called with the tuple of directory names
+            below the root, False to skip the directory (optional)
+        keep_file: function called with a file name, False
+            to skip the file (optional)
+        parts: names of the directories from the root down to directory
+
+    Returns:
+        generator of absolute filepaths
+    '''
+    for entry in _entries(directory):
+        if entry.is_dir():
+            subparts = parts + (entry.name,)
+            if keep_dir is None or keep_dir(subparts):
+                yield from walk_files(entry.path, keep_dir, keep_file, subparts)
+        elif entry.name.endswith(DATA_SUFFIXES) and (keep_file is None or keep_file(entry.name)):
+            yield os.path.abspath(entry.path)
+
+
+def log_file_date(name):
+    '''
+    Date of a log file from its name, YYYY-MM-DD-events.json[.gz|.zst]
+
+    Args:
+        name: file name
+
+    Returns:
+        datetime.date, None if the name has no date
+    '''
+    try:
+        return datetime.datetime.strptime(name[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def log_files(directory, since=None, until=None):
+    '''
+    Lazily finds the log files of a date range. Year and month
+    directories outside the range are skipped without listing them.
+    Without a range every file is found, with one only files named
+    by date in the range
+
+    Args:
+        directory: log_data directory
+        since: first date to load, inclusive (optional)
+        until: last date to load, inclusive (optional)
+
+    Returns:
+        generator of absolute filepaths
+    '''
+    if since is None and until is None:
+        return walk_files(directory)
+
+    first = since or datetime.date.min
+    last = until or datetime.date.max
+
+    def keep_dir(parts):
+        try:
+            numbers = tuple(int(part) for part in parts[:2])
+        except ValueError:
+            # Outside the YYYY/MM layout, listed but not pruned
+            return True
+        return (first.year, first.month)[:len(numbers)] <= numbers <= \
+            (last.year, last.month)[:len(numbers)]
+
+    def keep_file(name):
+        day = log_file_date(name)
+        return day is not None and first <= day <= last
+
+    return walk_files(directory, keep_dir, keep_file)
+
+
+def song_files(directory, prefix=None):
+    '''
+    Lazily finds the song files of track IDs starting with TR and a
+    prefix, e.g. prefix AB only lists song_data/A/B. Directories of
+    other prefixes are skipped without listing them
+
+    Args:
+        directory: song_data directory
+        prefix: letters of the track IDs after TR (optional)
+
+    Returns:
+        generator of absolute filepaths
+    '''
+    if not prefix:
+        return walk_files(directory)
+
+    def keep_dir(parts):
+        # The three directory levels are the 3rd to 5th letters of the track ID
+        return all(part == letter for part, letter in zip(parts, prefix[:3]))
+
+    def keep_file(name):
+        return name.startswith('TR' + prefix)
+
+    return walk_files(directory, keep_dir, keep_file)
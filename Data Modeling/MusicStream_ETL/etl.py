@@ -2,89 +2,357 @@
 
 # import prereq libraries
 import os
-import glob
-import psycopg2
+import argparse
+import datetime
+import itertools
+import time
+import signal
 import pandas as pd
 import numpy as np
-from io import StringIO
+from functools import partial
 from sql_queries import *
+from lookups import TrackIndex, DimensionKeys
+from cache import ParseCache, CACHE_MAX_BYTES
+from manifest import Manifest, transform_with_info, count_rows
+from metrics import Metrics, metrics
+from backends import BACKENDS, get_backend, default_backend
+from aggregates import apply_play_deltas, create_aggregate_tables
+from pipeline import pipeline, PIPELINE_QUEUE_SIZE
+from scheduler import schedule, SPLIT_BYTES
+from discovery import walk_files, log_files, song_files
+from partitions import TrackplayPartitions
+from watch import LogWatcher, WATCH_POLL_INTERVAL, WATCH_FLUSH_INTERVAL, WATCH_FLUSH_ROWS, \
+    WATCH_IDLE_SECONDS, WATCH_RESCAN_INTERVAL
+from create_tables import finalize_bulk_load
+from readers import read_events, read_song_file, read_song_batches, typed_frame, concat_frames, \
+    event_categories, EVENT_FIELDS, EVENT_SCHEMA, SONG_FIELDS, SONG_SCHEMA, SONG_BATCHSIZE, \
+    SONG_READ_THREADS
 
-def get_files(filepath):
+def copy_df(cur, table, df, backend=None, returning=None):
     '''
-    Helper function to process files
+    Helper function to bulk load dataframe entries to tables
+    with the native bulk path of the storage backend, e.g. in
+    Postgres COPY into a staging table merged into the target
+    table with INSERT ... SELECT ... ON CONFLICT DO NOTHING
     
     Args: 
-        filepath: Path to data files location
+        cur: cursor to database
+        table: name of the target table
+        df: dataframe containing data to load, with columns in
+            the same order as the target table
+        backend: storage Backend, Postgres if not given
+        returning: primary key column to return for the
+            inserted rows (optional)
   
     Returns:
-        None
+        list of primary keys of the inserted rows if
+        returning is given, else None
     '''
-    all_files = []
-    for root, dirs, files in os.walk(filepath):
-        files = glob.glob(os.path.join(root,'*.json'))
-        for f in files :
-            all_files.append(os.path.abspath(f))
+    if df.empty:
+        return [] if returning is not None else None
     
-    return all_files
+    return (backend or default_backend).load_df(cur, table, df, returning)
 
-def process_df(cur, insert_query, df):
+def copy_dimension(cur, table, df, dimension_keys=None, backend=None):
     '''
-    Helper function to load dataframe entries to tables
+    Helper function to bulk load dimension rows, skipping
+    rows whose key is already loaded if dimension_keys is given
     
     Args: 
         cur: cursor to database
-        insert_query: sql query to execute
+        table: name of the dimension table
         df: dataframe containing data to load
+        dimension_keys: DimensionKeys of loaded keys (optional)
+        backend: storage Backend, Postgres if not given
   
     Returns:
-        None
+        number of rows sent
     '''
-    for i, row in df.iterrows():
-        cur.execute(insert_query, row)
+    if dimension_keys is None:
+        copy_df(cur, table, df, backend)
+        return len(df)
+    
+    df, keys = dimension_keys.new_rows(table, df)
+    copy_df(cur, table, df, backend)
+    dimension_keys.add(table, keys)
+    
+    return len(df)
+
 
-def process_song_file(cur, datafile):
+def read_song_df(datafile, cache=None, content=None):
     '''
-    Function to process song files and load
-    artists and tracks tables
+    Function to read the song records of a song file,
+    from the parse cache if given and the file is cached
   
     Args:
-        cur: cursor to musicstream database
         datafile: filepath to song data file
+        cache: ParseCache of parsed files (optional)
+        content: bytes of the file, if already read (optional)
         
     Returns:
-        None
+        dataframe of song records
     '''
-    df = pd.read_json(datafile, lines=True)
-    df = df.replace({pd.np.nan: None})
+    if cache is not None:
+        key = cache.key(datafile, 'songs', content)
+        df = cache.get(key)
+        if df is not None:
+            return df
     
+    info, records = read_song_file(datafile, content)
+    df = typed_frame(records, SONG_FIELDS, SONG_SCHEMA)
+    
+    if cache is not None:
+        cache.put(key, df)
+    
+    return df
+
+
+def transform_song_file(datafile, cache=None, content=None):
+    '''
+    Function to read a song file and transform it into
+    load-ready artists and tracks data
+  
+    Args:
+        datafile: filepath to song data file
+        cache: ParseCache of parsed files (optional)
+        content: bytes of the file, if already read (optional)
+        
+    Returns:
+        dict of dataframes to load, keyed on target table
+    '''
+    # Timings are collected per file and merged into the run metrics
+    # by the loading process, transforms may run in worker processes
+    file_metrics = Metrics()
+    size = os.path.getsize(datafile) if content is None else len(content)
+    with file_metrics.timer('decode', bytes=size) as counts:
+        df = read_song_df(datafile, cache, content)
+        counts['rows'] = len(df)
+    with file_metrics.timer('transform', rows=len(df)):
+        data = transform_song_df(df)
+    data['metrics'] = file_metrics.stages
+    
+    return data
+
+
+def transform_song_df(df):
+    '''
+    Function to transform song records, from one file or from a
+    batch of files, into load-ready artists and tracks data
+  
+    Args:
+        df: dataframe of song records
+        
+    Returns:
+        dict of dataframes to load, keyed on target table
+    '''
     artist_data = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']]
     track_data = df[['song_id', 'title', 'artist_id', 'year', 'duration']]
     artist_data = artist_data.drop_duplicates()
     track_data = track_data.drop_duplicates()
     
-    process_df(cur, artists_table_insert, artist_data)
-    process_df(cur, tracks_table_insert, track_data)
-      
+    # Track index entries for these tracks
+    index_data = df.rename(columns={'artist_name': 'name', 'song_id': 'track_id'})
+    index_data = index_data[TrackIndex.columns]
     
-def process_log_file(cur, datafile):
+    return {'artists': artist_data, 'tracks': track_data, 'index': index_data}
+
+
+def load_song_data(cur, data, track_index=None, dimension_keys=None, backend=None):
     '''
-    Function to process log files and load
-    timetb, users, and track_plays tables
+    Function to load transformed song data into
+    artists and tracks tables
   
-    Args: 
+    Args:
         cur: cursor to musicstream database
+        data: dict of dataframes from transform_song_file
+        track_index: TrackIndex to add the loaded tracks to (optional)
+        dimension_keys: DimensionKeys used to only send new
+            artists and tracks (optional)
+        backend: storage Backend, Postgres if not given
+        
+    Returns:
+        None
+    '''
+    with metrics.timer('dimension_insert') as counts:
+        counts['rows'] += copy_dimension(cur, 'artists', data['artists'], dimension_keys, backend)
+        counts['rows'] += copy_dimension(cur, 'tracks', data['tracks'], dimension_keys, backend)
+
+    # Keep the track index up to date with the newly loaded tracks
+    if track_index is not None:
+        track_index.add(data['index'])
+
+
+# Fields identifying a log event, hashed into its trackplay ID
+EVENT_KEY_FIELDS = ['sessionId', 'itemInSession', 'ts', 'userId']
+
+def event_keys(df):
+    '''
+    Helper function to compute the trackplay IDs of a dataframe of
+    log events, signed 64-bit hashes of the fields that identify each
+    event. All rows are hashed at once by pandas
+  
+    Args: 
+        df: dataframe of log events, with ts still in milliseconds
+  
+    Returns:
+        series of trackplay IDs aligned with df, fitting in a postgres bigint
+    '''
+    fields = pd.DataFrame({field: df[field].to_numpy(dtype=np.int64) for field in EVENT_KEY_FIELDS})
+    keys = pd.util.hash_pandas_object(fields, index=False).to_numpy()
+    
+    return pd.Series(keys.view(np.int64), index=df.index)
+
+
+def build_time_df(ts):
+    '''
+    Helper function to build timetb records from a series of
+    timestamps, using vectorized datetime accessors
+  
+    Args: 
+        ts: series of datetime64 timestamps
+  
+    Returns:
+        dataframe with one row per distinct timestamp
+    '''
+    ts = ts.drop_duplicates()
+    
+    return pd.DataFrame({
+        'start_time': ts,
+        'hour': ts.dt.hour,
+        'day': ts.dt.day,
+        'week': ts.dt.isocalendar().week,
+        'month': ts.dt.month,
+        'year': ts.dt.year,
+        'weekday': ts.dt.day_name()})
+
+
+def read_log_df(datafile, cache=None, content=None, threaded=False):
+    '''
+    Function to read the NextSong events of a log file into one
+    dataframe, from the parse cache if given and the file is cached.
+    Used where a file is transformed as a whole, in worker processes,
+    the pipeline and the parse cache
+  
+    Args: 
         datafile: filepath to log file
+        cache: ParseCache of parsed files (optional)
+        content: bytes of the file, if already read (optional)
+        threaded: decompress a compressed file in a separate thread
   
     Returns:
-        None
+        dataframe of NextSong events
+    '''
+    if cache is not None:
+        key = cache.key(datafile, 'events', content)
+        df = cache.get(key)
+        if df is not None:
+            return df
+    
+    # Only NextSong events are read, these are the records that are relevant to us
+    chunks = list(read_events(datafile, content=content, threaded=threaded))
+    if chunks:
+        df = concat_frames(chunks)
+    else:
+        df = typed_frame([], EVENT_FIELDS, EVENT_SCHEMA, categories=event_categories)
+    
+    if cache is not None:
+        cache.put(key, df)
+    
+    return df
+
+
+def transform_log_file(datafile, cache=None, content=None, threaded=False):
+    '''
+    Function to read a log file and transform it into
+    load-ready timetb, users and trackplays data
+  
+    Args: 
+        datafile: filepath to log file
+        cache: ParseCache of parsed files (optional)
+        content: bytes of the file, if already read (optional)
+        threaded: decompress a compressed file in a separate thread
+  
+    Returns:
+        dict of dataframes to load, keyed on target table.
+        Trackplays still carry the song, artist and length
+        columns, track and artist IDs are resolved at load time
+    '''
+    # Timings are collected per file and merged into the run metrics
+    # by the loading process, transforms may run in worker processes
+    file_metrics = Metrics()
+    size = os.path.getsize(datafile) if content is None else len(content)
+    with file_metrics.timer('decode', bytes=size) as counts:
+        df = read_log_df(datafile, cache, content, threaded)
+        counts['rows'] = len(df)
+    with file_metrics.timer('transform', rows=len(df)):
+        data = transform_log_events(df)
+    data['metrics'] = file_metrics.stages
+    
+    return data
+
+
+def transform_log_chunks(datafile, cache=None, content=None, threaded=False):
+    '''
+    Function to read a log file and transform it into load-ready
+    timetb, users and trackplays data one chunk of events at a
+    time (see read_events), so that the file is never held in
+    memory as a whole. With a parse cache, files are read and
+    cached as a whole and transformed at once
+  
+    Args: 
+        datafile: filepath to log file
+        cache: ParseCache of parsed files (optional)
+        content: bytes of the file, if already read (optional)
+        threaded: decompress a compressed file in a separate thread
+  
+    Returns:
+        generator of dicts of dataframes to load, keyed on target
+        table, as returned by transform_log_file
+    '''
+    if cache is not None:
+        yield transform_log_file(datafile, cache, content, threaded)
+        return
+    
+    events = read_events(datafile, content=content, threaded=threaded)
+    size = os.path.getsize(datafile) if content is None else len(content)
+    empty = True
+    while True:
+        chunk_metrics = Metrics()
+        with chunk_metrics.timer('decode', bytes=size if empty else 0) as counts:
+            df = next(events, None)
+            counts['rows'] = 0 if df is None else len(df)
+        if df is None:
+            break
+        with chunk_metrics.timer('transform', rows=len(df)):
+            data = transform_log_events(df)
+        data['metrics'] = chunk_metrics.stages
+        empty = False
+        yield data
+    
+    # Files without NextSong events are still recorded with their counts
+    if empty:
+        data = transform_log_events(typed_frame([], EVENT_FIELDS, EVENT_SCHEMA,
+                                                categories=event_categories))
+        data['metrics'] = chunk_metrics.stages
+        yield data
+
+
+def transform_log_events(df):
+    '''
+    Function to transform NextSong events into
+    load-ready timetb, users and trackplays data
+  
+    Args: 
+        df: dataframe of NextSong events from read_events
+  
+    Returns:
+        dict of dataframes to load, keyed on target table
     '''
-    df = pd.read_json(datafile, lines=True)
-    df = df.replace({pd.np.nan: None})
     df = df.drop_duplicates()
 
-    # filter records by nextsong action
-    # These are the records that are relevant to us
-    df = df[df['page'] == 'NextSong']
+    # Key each play on the event itself, so reloading a file or
+    # loading files concurrently never produces duplicate plays
+    trackplay_ids = event_keys(df)
 
     # Fill timetb and users tables
     
@@ -92,72 +360,390 @@ def process_log_file(cur, datafile):
     df['ts'] = pd.to_datetime(df['ts'], unit='ms')
 
     # Extract timestamp information
-    time_data = []
-
-    for line in df['ts']:
-        time_data.append([line, line.hour, line.day, line.week, line.month, line.year, line.day_name()])
-
-    # Specify labels for these columns and set to column_labels
-    column_labels = ['start_time', 'hour', 'day', 'week', 'month', 'year', 'weekday']
-    time_df = pd.DataFrame.from_records(time_data, columns=column_labels)
+    time_df = build_time_df(df['ts'])
     
     users_df = df[['userId', 'firstName', 'lastName', 'gender', 'level']]
 
-    process_df(cur, timetb_table_insert, time_df)
-    process_df(cur, users_table_insert, users_df)
+    # Select the timestamp, user ID, level, session ID, location, user agent
+    # and the fields needed to look up song ID and artist ID
+    trackplay_df = pd.DataFrame({
+        'trackplay_id': trackplay_ids,
+        'start_time': df['ts'],
+        'user_id': df['userId'],
+        'tier': df['level'],
+        'session_id': df['sessionId'],
+        'item_in_session': df['itemInSession'],
+        'location': df['location'],
+        'user_agent': df['userAgent'],
+        'song': df['song'],
+        'artist': df['artist'],
+        'length': df['length']})
+
+    return {'timetb': time_df, 'users': users_df, 'trackplays': trackplay_df}
+
+
+def load_log_data(cur, data, track_index=None, dimension_keys=None, backend=None,
+                  aggregates=False, partitions=None):
+    '''
+    Function to load transformed log data into
+    timetb, users, and track_plays tables
+  
+    Args: 
+        cur: cursor to musicstream database
+        data: dict of dataframes from transform_log_file
+        track_index: TrackIndex used to resolve track and artist IDs,
+            loaded from the database if not given
+        dimension_keys: DimensionKeys used to only send new
+            timestamps and users (optional)
+        backend: storage Backend, Postgres if not given
+        aggregates: add the newly loaded plays to the play
+            count aggregate tables
+        partitions: TrackplayPartitions routing plays into the
+            partitions of a partitioned trackplays table (optional)
+  
+    Returns:
+        None
+    '''
+    with metrics.timer('dimension_insert') as counts:
+        counts['rows'] += copy_dimension(cur, 'timetb', data['timetb'], dimension_keys, backend)
+        counts['rows'] += copy_dimension(cur, 'users', data['users'], dimension_keys, backend)
 
     # Fill trackplays table
     
-    # The log files dont have artist_id and track_id, so these have to be identified 
-    # first using track_search query
-    for ind, row in df.iterrows():
-        cur.execute(track_search, (row.song, row.artist, row.length))
-        results = cur.fetchone()
-
-        if results:
-            track_id, artist_id = results
-        else:
-            track_id, artist_id = None, None
+    # The log files dont have artist_id and track_id, so these are resolved
+    # for all records at once against the in-memory track index
+    if track_index is None:
+        track_index = TrackIndex()
+        track_index.load(cur)
+    trackplay_df = data['trackplays']
+    with metrics.timer('track_lookup', rows=len(trackplay_df)):
+        track_keys = track_index.resolve(trackplay_df)
 
-        # Select the timestamp, user ID, level, song ID, artist ID, session ID, location, 
-        # and user agent and set to trackplay_data
-        trackplay_data = (
-            ind,
-            pd.to_datetime(row.ts, unit='ms'),
-            row.userId,
-            row.level,
-            track_id,
-            artist_id,
-            row.sessionId,
-            row.location,
-            row.userAgent)
+    # Plays of tracks not loaded yet keep their song, artist and length
+    # in a side table, so reconcile.py can resolve them later
+    unresolved = track_keys['track_id'].isna() & trackplay_df['song'].notna()
+    unresolved_df = trackplay_df.loc[unresolved, ['trackplay_id', 'song', 'artist', 'length']]
 
-        cur.execute(trackplays_table_insert, trackplay_data)
+    trackplay_df = trackplay_df[['trackplay_id', 'start_time', 'user_id', 'tier']].assign(
+        track_id=track_keys['track_id'],
+        artist_id=track_keys['artist_id'],
+        session_id=trackplay_df['session_id'],
+        item_in_session=trackplay_df['item_in_session'],
+        location=trackplay_df['location'],
+        user_agent=trackplay_df['user_agent'])
+    with metrics.timer('fact_insert', rows=len(trackplay_df)):
+        returning = 'trackplay_id' if aggregates else None
+        if partitions is not None:
+            inserted = partitions.load_df(cur, trackplay_df, backend, returning)
+        else:
+            inserted = copy_df(cur, 'trackplays', trackplay_df, backend, returning)
+        copy_df(cur, 'unresolved_plays', unresolved_df, backend)
     
+    # Only plays that were not loaded before count towards the aggregates
+    if aggregates:
+        with metrics.timer('aggregates') as counts:
+            # Events sharing a key share a trackplay ID, only the first
+            # was inserted, as with ON CONFLICT DO NOTHING
+            new_plays = trackplay_df[trackplay_df['trackplay_id'].isin(inserted)]
+            new_plays = new_plays.drop_duplicates('trackplay_id')
+            counts['rows'] = apply_play_deltas(cur, new_plays, backend)
+
 
-def process_data(cur, conn, filepath, func):
+def process_data(cur, conn, filepath, transform, load, workers=1,
+                 manifest=None, full_refresh=False, pipelined=False,
+                 queue_size=PIPELINE_QUEUE_SIZE, commit_every=1, discover=None,
+                 split_bytes=None, line_index=False, stream=None):
     '''
     Function for processing all log files at the
-    specified filepath
+    specified filepath.
+    With more than one worker, files are read and transformed
+    in a process pool, largest first, while this process loads
+    the results as they complete over its own connection. When pipelined, files
+    are read and transformed by background threads instead
   
     Args: 
         cur: cursor to musicstream database
         conn: connection to musicstream database
         filepath: filepath to logs parent dir
-        func: function for processing log file
+        transform: function reading a file into load-ready data
+        load: function loading transformed data to the database
+        workers: number of processes used to transform files
+        manifest: Manifest used to skip files that are already
+            loaded and to record loaded files (optional)
+        full_refresh: load all files even if the manifest has them
+        pipelined: read, transform and load files concurrently
+        queue_size: number of files queued between pipeline stages
+        commit_every: number of files loaded per transaction
+        discover: function lazily finding the data files under
+            filepath, all JSON files if not given
+        split_bytes: with more than one worker, size above which
+            files are transformed in line-aligned byte ranges. Loaded
+            ranges are recorded, an interrupted file resumes mid-file
+        line_index: find the ranges with a sidecar line index
+        stream: function reading a file into a generator of
+            load-ready chunks, used instead of transform when files
+            are transformed one at a time in this process (optional).
+            Workers and the pipeline hand over whole files
   
     Returns:
         None
     '''
     # Get files
-    all_files = get_files(filepath)
-    print(f'{len(all_files)} files found in {filepath}')
+    with metrics.timer('discovery') as counts:
+        all_files = list((discover or walk_files)(filepath))
+        print(f'{len(all_files)} files found in {filepath}')
+        
+        if manifest is not None:
+            all_files = manifest.select(all_files, full_refresh, cur)
+            print(f'{len(all_files)} new or changed files to load')
+        counts['rows'] = len(all_files)
+    if manifest is not None:
+        commit(conn)
     
-    for i, datafile in enumerate(all_files):
-        func(cur, datafile)
-        conn.commit()
+    if pipelined:
+        # The pipeline pairs each file with its info itself
+        batches = pipeline(all_files, transform, queue_size,
+                           wait_timer=partial(metrics.timer, 'queue_wait'))
+        if manifest is None:
+            batches = (data for info, data in batches)
+        load_batches(cur, conn, load, batches, manifest, commit_every)
+        return
+    
+    if workers > 1 and len(all_files) > 1:
+        # Largest files first, loaded in completion order
+        batches = schedule(all_files, transform, workers, split_bytes,
+                           manifest=None if full_refresh else manifest, line_index=line_index)
+        if manifest is None:
+            batches = (data for info, data in batches if data is not None)
+        load_batches(cur, conn, load, batches, manifest, commit_every)
+        return
+    
+    transform = partial(transform_with_info, stream or transform)
+    load_batches(cur, conn, load, map(transform, all_files), manifest, commit_every)
+
+
+def process_song_batches(cur, conn, filepath, track_index=None, dimension_keys=None,
+                         batchsize=SONG_BATCHSIZE, threads=SONG_READ_THREADS,
+                         manifest=None, full_refresh=False, backend=None, discover=None):
+    '''
+    Function for processing all song files at the specified
+    filepath in batches. Files are read by a thread pool and
+    each batch of files is transformed, loaded and committed at once
+  
+    Args: 
+        cur: cursor to musicstream database
+        conn: connection to musicstream database
+        filepath: filepath to songs parent dir
+        track_index: TrackIndex to add the loaded tracks to (optional)
+        dimension_keys: DimensionKeys used to only send new
+            artists and tracks (optional)
+        batchsize: number of files per batch
+        threads: number of threads reading files
+        manifest: Manifest used to skip files that are already
+            loaded and to record loaded files (optional)
+        full_refresh: load all files even if the manifest has them
+        backend: storage Backend, Postgres if not given
+        discover: function lazily finding the data files under
+            filepath, all JSON files if not given
+  
+    Returns:
+        None
+    '''
+    # Get files
+    with metrics.timer('discovery') as counts:
+        all_files = list((discover or walk_files)(filepath))
+        print(f'{len(all_files)} files found in {filepath}')
+        
+        if manifest is not None:
+            all_files = manifest.select(all_files, full_refresh, cur)
+            print(f'{len(all_files)} new or changed files to load')
+        counts['rows'] = len(all_files)
+    if manifest is not None:
+        commit(conn)
+    
+    batches = read_song_batches(all_files, batchsize, threads)
+    for i in itertools.count():
+        with metrics.timer('decode') as counts:
+            batch = next(batches, None)
+            if batch is not None:
+                counts['rows'] = len(batch[1])
+                counts['bytes'] = sum(info['size'] for info in batch[0])
+        if batch is None:
+            break
+        
+        infos, df, file_counts = batch
+        with metrics.timer('transform', rows=len(df)):
+            data = transform_song_df(df)
+        load_song_data(cur, data, track_index, dimension_keys, backend)
+        if manifest is not None:
+            with metrics.timer('manifest', rows=len(infos)):
+                manifest.record_many(cur, [(info, {'artists': n, 'tracks': n})
+                                           for info, n in zip(infos, file_counts)])
+        commit(conn)
+        print(f'Batch {i+1} processed ({len(infos)} files).')
+
+
+def load_batches(cur, conn, load, batches, manifest=None, commit_every=1):
+    '''
+    Helper function to load transformed files one at a time,
+    committing after every commit_every files
+  
+    Args: 
+        cur: cursor to musicstream database
+        conn: connection to musicstream database
+        load: function loading transformed data to the database
+        batches: iterable of transformed files, paired with their
+            file info if a manifest is given. Ranges of files loaded
+            in ranges are paired with their range info, and files
+            completed by their hash have no data (see scheduler).
+            A file streamed in chunks is a generator of transformed
+            chunks, each loaded on its own
+        manifest: Manifest to record loaded files in (optional)
+        commit_every: number of files loaded per transaction
+  
+    Returns:
+        None
+    '''
+    i = -1
+    for i, data in enumerate(batches):
+        if manifest is not None:
+            info, data = data
+        if isinstance(data, dict):
+            metrics.merge(data.pop('metrics', {}))
+            load(cur, data)
+        elif data is not None:
+            rows = {}
+            for chunk in data:
+                metrics.merge(chunk.pop('metrics', {}))
+                load(cur, chunk)
+                for table, n in count_rows(chunk).items():
+                    rows[table] = rows.get(table, 0) + n
+            if manifest is not None:
+                info = dict(info, rows=rows)
+        if manifest is not None and info is not None:
+            with metrics.timer('manifest', rows=1):
+                manifest.record(cur, info, data)
+        # Files are recorded in the manifest in the same transaction
+        # as their rows, a crash reloads the uncommitted files
+        if (i + 1) % commit_every == 0:
+            commit(conn)
         print(f'File {i+1} processed.')
     
+    if (i + 1) % commit_every != 0:
+        commit(conn)
+
+
+def watch_logs(cur, conn, filepath, load, manifest, poll_interval=WATCH_POLL_INTERVAL,
+               flush_interval=WATCH_FLUSH_INTERVAL, flush_rows=WATCH_FLUSH_ROWS,
+               idle_seconds=WATCH_IDLE_SECONDS, rescan_interval=WATCH_RESCAN_INTERVAL):
+    '''
+    Function loading log files continuously as they are written.
+    The log directory is polled for new and appended files, and
+    the new events are loaded in micro-batches, each committed
+    with the manifest entries of its files. Runs until interrupted
+    with Ctrl-C or SIGTERM
+  
+    Args: 
+        cur: cursor to musicstream database
+        conn: connection to musicstream database
+        filepath: filepath to logs parent dir
+        load: function loading transformed data to the database
+        manifest: Manifest of loaded files, also recording how
+            much of each file is loaded
+        poll_interval: seconds between polls
+        flush_interval: maximum seconds events wait to be loaded
+        flush_rows: number of events that triggers a load
+        idle_seconds: seconds after which a file that stopped
+            growing is only checked on full rescans
+        rescan_interval: seconds between full rescans
+  
+    Returns:
+        None
+    '''
+    watcher = LogWatcher(filepath, manifest, idle_seconds, rescan_interval)
+    chunks = []
+    tailed_files = {}
+    rows = 0
+    first_event_at = None
+    
+    def flush():
+        # Files whose new lines held no NextSong events are
+        # still recorded, so their offsets move on
+        nonlocal rows, first_event_at
+        if chunks:
+            df = concat_frames(chunks, ignore_index=True)
+            with metrics.timer('transform', rows=len(df)):
+                data = transform_log_events(df)
+            load(cur, data)
+        with metrics.timer('manifest', rows=len(tailed_files)):
+            manifest.record_many(cur, [(tailed.info(), {'trackplays': tailed.rows})
+                                       for tailed in tailed_files.values()])
+        commit(conn)
+        print(f'{rows} events from {len(tailed_files)} files loaded.')
+        chunks.clear()
+        tailed_files.clear()
+        rows = 0
+        first_event_at = None
+    
+    # Ctrl-C or SIGTERM stop the watch between micro-batches,
+    # a load is never interrupted half way
+    stopping = []
+    def stop(signum, frame):
+        stopping.append(signum)
+    handlers = {signum: signal.signal(signum, stop) for signum in [signal.SIGINT, signal.SIGTERM]}
+    
+    print(f'Watching {filepath}, interrupt to stop')
+    try:
+        while not stopping:
+            appended = 0
+            for tailed, content in watcher.poll():
+                appended += 1
+                with metrics.timer('decode', bytes=len(content)) as counts:
+                    for df in read_events(tailed.path, content=content):
+                        chunks.append(df)
+                        tailed.rows += len(df)
+                        rows += len(df)
+                        counts['rows'] += len(df)
+                tailed_files[tailed.path] = tailed
+                if first_event_at is None:
+                    first_event_at = time.monotonic()
+                
+                # Large appends, e.g. when catching up, are loaded as they are read
+                if rows >= flush_rows:
+                    flush()
+                if stopping:
+                    break
+            
+            if tailed_files and time.monotonic() - first_event_at >= flush_interval:
+                flush()
+            
+            # Poll again right away while files are still being caught up on
+            if not appended and not stopping:
+                time.sleep(poll_interval)
+        
+        print('Stopping, loading buffered events')
+        if tailed_files:
+            flush()
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+
+def commit(conn):
+    '''
+    Helper function to commit the running transaction,
+    timed as the commit stage
+  
+    Args: 
+        conn: connection to musicstream database
+  
+    Returns:
+        None
+    '''
+    with metrics.timer('commit'):
+        metrics.round_trip()
+        conn.commit()
+    
     
 def main():
     '''
@@ -172,13 +758,203 @@ def main():
     Returns:
         None
     '''
+    parser = argparse.ArgumentParser(description='Load MusicStream data files')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='postgres',
+                        help='storage backend of the MusicStream database')
+    parser.add_argument('--database',
+                        help='connection string (postgres) or database file (sqlite, duckdb), '
+                             'the backend default if not given')
+    parser.add_argument('--data-dir', default='data',
+                        help='directory holding the song_data and log_data directories')
+    parser.add_argument('--phase', choices=['all', 'songs', 'logs'], default='all',
+                        help='load only song files or only log files')
+    parser.add_argument('--since', type=datetime.date.fromisoformat,
+                        help='only load log files of this date (YYYY-MM-DD) and later')
+    parser.add_argument('--until', type=datetime.date.fromisoformat,
+                        help='only load log files of this date (YYYY-MM-DD) and earlier')
+    parser.add_argument('--song-prefix',
+                        help='only load song files of track IDs starting with TR and this prefix')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to read and transform files')
+    parser.add_argument('--split-size', type=int, default=SPLIT_BYTES >> 20,
+                        help='with --workers, size in MB above which log files are split '
+                             'into line-aligned ranges transformed in parallel, 0 to never split')
+    parser.add_argument('--line-index', action='store_true',
+                        help='split log files with a sidecar index of their line offsets, '
+                             'built on first use and written next to each file')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='read, transform and load files concurrently in one process')
+    parser.add_argument('--queue-size', type=int, default=PIPELINE_QUEUE_SIZE,
+                        help='number of files queued between pipeline stages')
+    parser.add_argument('--commit-every', type=int, default=1,
+                        help='number of files loaded per transaction')
+    parser.add_argument('--song-batch-size', type=int, default=0,
+                        help='load song files in batches of this many files, read by a thread pool')
+    parser.add_argument('--io-threads', type=int, default=SONG_READ_THREADS,
+                        help='number of threads reading song files in batch mode')
+    parser.add_argument('--decompress-thread', action='store_true',
+                        help='decompress gzip and zstd log files in a separate thread '
+                             'overlapping with parsing')
+    parser.add_argument('--parse-cache', metavar='DIR',
+                        help='directory of a columnar cache of parsed data files')
+    parser.add_argument('--parse-cache-size', type=int, default=CACHE_MAX_BYTES >> 20,
+                        help='size cap of the parse cache in MB')
+    parser.add_argument('--no-dimension-cache', action='store_true',
+                        help='send every dimension row instead of only rows with new keys')
+    parser.add_argument('--bulk-load', action='store_true',
+                        help='commit without waiting for WAL flush, then make tables logged and '
+                             'add foreign keys after loading (see create_tables.py --bulk-load)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and load new and appended log files as they are written')
+    parser.add_argument('--poll-interval', type=float, default=WATCH_POLL_INTERVAL,
+                        help='seconds between polls of the log directory in watch mode')
+    parser.add_argument('--flush-interval', type=float, default=WATCH_FLUSH_INTERVAL,
+                        help='maximum seconds new events wait to be loaded in watch mode')
+    parser.add_argument('--flush-rows', type=int, default=WATCH_FLUSH_ROWS,
+                        help='number of new events that triggers a load in watch mode')
+    parser.add_argument('--no-aggregates', action='store_true',
+                        help='do not update the play count aggregate tables, '
+                             'rebuild them later with create_tables.py --rebuild-aggregates')
+    parser.add_argument('--retention-days', type=int,
+                        help='after loading, drop the trackplays partitions holding only plays '
+                             'older than this many days (create_tables.py --partition)')
+    parser.add_argument('--detach-partitions', action='store_true',
+                        help='with --retention-days, detach old partitions instead of dropping them')
+    parser.add_argument('--full-refresh', action='store_true',
+                        help='reload all files, including ones already in the load manifest')
+    parser.add_argument('--metrics-file',
+                        help='write per-stage metrics of the run to this file')
+    parser.add_argument('--metrics-format', choices=['jsonl', 'prometheus'], default='jsonl',
+                        help='format of the metrics file, appended JSON lines or Prometheus text')
+    args = parser.parse_args()
+    if args.pipeline and args.workers > 1:
+        parser.error('--pipeline cannot be combined with --workers')
+    if args.commit_every < 1 or args.queue_size < 1:
+        parser.error('--commit-every and --queue-size must be at least 1')
+    if args.watch and (args.phase == 'songs' or args.workers > 1 or args.pipeline or args.bulk_load
+                       or args.since or args.until):
+        parser.error('--watch cannot be combined with --phase songs, --workers, --pipeline, '
+                     '--bulk-load, --since or --until')
+    backend = get_backend(args.backend, args.database)
+    if args.bulk_load and not backend.foreign_keys:
+        parser.error(f'--bulk-load is not supported by the {backend.name} backend')
+    if args.retention_days is not None and not backend.partitioning:
+        parser.error(f'--retention-days is not supported by the {backend.name} backend')
+    
     # Connect to db and obtain cursor
-    conn = psycopg2.connect("host=127.0.0.1 dbname=musicstreamdb user=student password=student")
-    cur = conn.cursor()
+    conn = backend.connect()
+    cur = backend.cursor(conn)
+    
+    # A crash may lose the last commits, the load manifest is
+    # committed with the data so those files are loaded again.
+    # Tables created with --unlogged, the manifest included, are
+    # all truncated by a crash, and every file is loaded again
+    if args.bulk_load:
+        backend.relax_commit(cur)
+    
+    # Build the track index once, it is kept up to date as songs are loaded
+    track_index = TrackIndex()
+    track_index.load(cur)
+    
+    # Keys of the dimension rows already loaded, seeded from the database
+    dimension_keys = None
+    if not args.no_dimension_cache:
+        dimension_keys = DimensionKeys()
+        dimension_keys.load(cur)
+    
+    # Cache of parsed files, reused by backfills and rebuilds
+    cache = None
+    if args.parse_cache:
+        cache = ParseCache(args.parse_cache, args.parse_cache_size << 20)
+    
+    # Manifest of already loaded files, so only new or changed files are loaded
+    manifest = Manifest(backend)
+    manifest.load(cur)
+    cur.execute(backend.translate(unresolved_plays_table_create))
+    if not args.no_aggregates:
+        create_aggregate_tables(cur, backend)
+    conn.commit()
+    
+    # Partitions of trackplays if it is partitioned, plays are
+    # loaded directly into the partition of their start time
+    partitions = None
+    if backend.partitioning:
+        partitions = TrackplayPartitions()
+        partitions.load(cur)
+        if partitions.granularity is None:
+            partitions = None
+    if args.retention_days is not None and partitions is None:
+        parser.error('--retention-days needs a partitioned trackplays table '
+                     '(create_tables.py --partition)')
+    
+    song_path = os.path.join(args.data_dir, 'song_data')
+    log_path = os.path.join(args.data_dir, 'log_data')
+    # Directories outside the date range or prefix are not listed
+    discover_songs = partial(song_files, prefix=args.song_prefix)
+    discover_logs = partial(log_files, since=args.since, until=args.until)
+    
+    # Process song and log data files, songs first so that
+    # plays can be matched to the tracks they reference
+    if args.phase != 'logs' and args.song_batch_size > 0:
+        process_song_batches(cur, conn, filepath = song_path,
+                             track_index = track_index,
+                             dimension_keys = dimension_keys,
+                             batchsize = args.song_batch_size,
+                             threads = args.io_threads,
+                             manifest = manifest, full_refresh = args.full_refresh,
+                             backend = backend, discover = discover_songs)
+    elif args.phase != 'logs':
+        process_data(cur, conn, filepath = song_path,
+                     transform = partial(transform_song_file, cache=cache),
+                     load = partial(load_song_data, track_index=track_index,
+                                    dimension_keys=dimension_keys, backend=backend),
+                     workers = args.workers,
+                     manifest = manifest, full_refresh = args.full_refresh,
+                     pipelined = args.pipeline, queue_size = args.queue_size,
+                     commit_every = args.commit_every, discover = discover_songs)
+    if args.watch:
+        watch_logs(cur, conn, filepath = log_path,
+                   load = partial(load_log_data, track_index=track_index,
+                                  dimension_keys=dimension_keys, backend=backend,
+                                  aggregates=not args.no_aggregates,
+                                  partitions=partitions),
+                   manifest = manifest, poll_interval = args.poll_interval,
+                   flush_interval = args.flush_interval, flush_rows = args.flush_rows)
+    elif args.phase != 'songs':
+        process_data(cur, conn, filepath = log_path,
+                     transform = partial(transform_log_file, cache=cache,
+                                         threaded=args.decompress_thread),
+                     load = partial(load_log_data, track_index=track_index,
+                                    dimension_keys=dimension_keys, backend=backend,
+                                    aggregates=not args.no_aggregates,
+                                    partitions=partitions),
+                     workers = args.workers,
+                     manifest = manifest, full_refresh = args.full_refresh,
+                     pipelined = args.pipeline, queue_size = args.queue_size,
+                     commit_every = args.commit_every, discover = discover_logs,
+                     split_bytes = args.split_size << 20, line_index = args.line_index,
+                     stream = partial(transform_log_chunks, cache=cache,
+                                      threaded=args.decompress_thread))
+    print(f'Track lookups: {track_index.hits} hits, {track_index.misses} misses '
+          f'({track_index.match_rate:.1%} matched)')
+    if partitions is not None and partitions.created:
+        print(f'Created {partitions.created} trackplays partitions')
+    if args.retention_days is not None:
+        cutoff = pd.Timestamp.now().normalize() - pd.Timedelta(days=args.retention_days)
+        removed = partitions.remove_before(cur, conn, cutoff, detach=args.detach_partitions)
+        print(f'{"Detached" if args.detach_partitions else "Dropped"} {len(removed)} '
+              f'trackplays partitions before {cutoff.date()}')
+    if args.bulk_load:
+        violations = finalize_bulk_load(cur, conn)
+        print(f'Foreign key violations: {sum(violations.values())}')
+    
+    if dimension_keys is not None:
+        skipped = ', '.join(f'{n} {table}' for table, n in dimension_keys.skipped.items())
+        print(f'Dimension rows already loaded, not sent: {skipped}')
     
-    # Process song and log data files
-    process_data(cur, conn, filepath = 'data/song_data', func = process_song_file)
-    process_data(cur, conn, filepath = 'data/log_data', func = process_log_file)
+    metrics.print_summary()
+    if args.metrics_file:
+        metrics.write(args.metrics_file, args.metrics_format)
 
     # Close cursor and connection
     cur.close()
@@ -0,0 +1,266 @@
+# Synthetic MusicStream data generator
+# Writes song_data and log_data in the same layout and JSON shape
+# as the sample data, at a configurable scale
+
+import os
+import json
+import argparse
+import string
+import numpy as np
+import pandas as pd
+
+ID_CHARS = np.array(list(string.ascii_uppercase + string.digits))
+
+FIRST_NAMES = ['Walter', 'Kaylee', 'Ryan', 'Jacob', 'Lily', 'Tegan', 'Chloe', 'Aleena', 'Jayden',
+               'Mohammad', 'Kate', 'Matthew', 'Sara', 'Layla', 'Avery', 'Rylan', 'Jordan', 'Ava']
+LAST_NAMES = ['Frye', 'Summers', 'Smith', 'Klein', 'Koch', 'Levine', 'Cuevas', 'Kirby', 'Graves',
+              'Rodriguez', 'Harrell', 'Jones', 'Johnson', 'Garrison', 'Watkins', 'George', 'Hogan']
+LOCATIONS = ['San Francisco-Oakland-Hayward, CA', 'Phoenix-Mesa-Scottsdale, AZ',
+             'San Jose-Sunnyvale-Santa Clara, CA', 'Lansing-East Lansing, MI',
+             'New York-Newark-Jersey City, NY-NJ-PA', 'Chicago-Naperville-Elgin, IL-IN-WI',
+             'Atlanta-Sandy Springs-Roswell, GA', 'Portland-South Portland, ME',
+             'Houston-The Woodlands-Sugar Land, TX', 'Waterloo-Cedar Falls, IA']
+USER_AGENTS = [
+    '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/36.0.1985.143 Safari/537.36"',
+    '"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/35.0.1916.153 Safari/537.36"',
+    '"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Ubuntu Chromium/36.0.1985.125 Chrome/36.0.1985.125 Safari/537.36"',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0',
+    '"Mozilla/5.0 (iPhone; CPU iPhone OS 7_1_2 like Mac OS X) AppleWebKit/537.51.2 '
+    '(KHTML, like Gecko) Version/7.0 Mobile/11D257 Safari/9537.53"']
+WORDS = ['love', 'night', 'heart', 'blue', 'dream', 'fire', 'rain', 'home', 'light', 'road',
+         'song', 'time', 'summer', 'river', 'gold', 'dance', 'city', 'moon', 'wild', 'stone']
+
+# Non NextSong pages with method, status and relative frequency
+OTHER_PAGES = [('Home', 'GET', 200, 10), ('Settings', 'GET', 200, 2), ('Help', 'GET', 200, 1),
+               ('About', 'GET', 200, 1), ('Upgrade', 'GET', 200, 1), ('Downgrade', 'GET', 200, 1),
+               ('Save Settings', 'PUT', 307, 1), ('Error', 'GET', 404, 1)]
+
+def random_ids(rng, prefix, n):
+    '''
+    Generates unique IDs in the Million Song Dataset format,
+    e.g. TRAAAAW128F429D538
+
+    Args:
+        rng: numpy random generator
+        prefix: two letter ID prefix (TR, SO, AR)
+        n: number of IDs
+
+    Returns:
+        list of IDs
+    '''
+    ids = set()
+    while len(ids) < n:
+        chars = rng.choice(ID_CHARS, size=(n - len(ids), 16))
+        ids.update(prefix + ''.join(row) for row in chars)
+    return sorted(ids)[:n]
+
+
+def random_title(rng):
+    '''
+    Generates a random track title or artist name
+    '''
+    words = rng.choice(WORDS, size=rng.integers(1, 4))
+    return ' '.join(words).title()
+
+
+def zipf_probabilities(n, s):
+    '''
+    Probabilities of ranks 1..n under a Zipf distribution with exponent s
+    '''
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def generate_songs(rng, output, n_songs, n_artists):
+    '''
+    Writes one song file per track under output/song_data/X/Y/Z/
+
+    Args:
+        rng: numpy random generator
+        output: output data directory
+        n_songs: number of tracks
+        n_artists: number of artists
+
+    Returns:
+        dataframe of the generated catalog
+    '''
+    artists = pd.DataFrame({
+        'artist_id': random_ids(rng, 'AR', n_artists),
+        'artist_name': [random_title(rng) for _ in range(n_artists)],
+        'artist_location': rng.choice(LOCATIONS + [''], size=n_artists)})
+    has_coords = rng.random(n_artists) < 0.4
+    artists['artist_latitude'] = np.where(has_coords, rng.uniform(-60, 70, n_artists).round(5), np.nan)
+    artists['artist_longitude'] = np.where(has_coords, rng.uniform(-150, 150, n_artists).round(5), np.nan)
+
+    songs = artists.iloc[rng.integers(0, n_artists, n_songs)].reset_index(drop=True)
+    songs['track_id'] = random_ids(rng, 'TR', n_songs)
+    songs['song_id'] = random_ids(rng, 'SO', n_songs)
+    songs['title'] = [random_title(rng) for _ in range(n_songs)]
+    songs['duration'] = rng.gamma(9.0, 27.0, n_songs).round(5)
+    songs['year'] = np.where(rng.random(n_songs) < 0.5, 0, rng.integers(1960, 2011, n_songs))
+
+    for song in songs.itertuples():
+        directory = os.path.join(output, 'song_data', *song.track_id[2:5])
+        os.makedirs(directory, exist_ok=True)
+        record = {'num_songs': 1,
+                  'artist_id': song.artist_id,
+                  'artist_latitude': None if np.isnan(song.artist_latitude) else song.artist_latitude,
+                  'artist_longitude': None if np.isnan(song.artist_longitude) else song.artist_longitude,
+                  'artist_location': song.artist_location,
+                  'artist_name': song.artist_name,
+                  'song_id': song.song_id,
+                  'title': song.title,
+                  'duration': song.duration,
+                  'year': int(song.year)}
+        with open(os.path.join(directory, f'{song.track_id}.json'), 'w') as f:
+            json.dump(record, f)
+
+    return songs
+
+
+def generate_users(rng, n_users, start):
+    '''
+    Generates the app users
+
+    Args:
+        rng: numpy random generator
+        n_users: number of users
+        start: first day of generated events
+
+    Returns:
+        list of user dicts
+    '''
+    start_ms = int(start.timestamp() * 1000)
+    return [{'userId': str(i + 1),
+             'firstName': str(rng.choice(FIRST_NAMES)),
+             'lastName': str(rng.choice(LAST_NAMES)),
+             'gender': str(rng.choice(['M', 'F'])),
+             'level': 'paid' if rng.random() < 0.2 else 'free',
+             'location': str(rng.choice(LOCATIONS)),
+             'userAgent': str(rng.choice(USER_AGENTS)),
+             'registration': float(start_ms - int(rng.integers(1, 90)) * 86400000)}
+            for i in range(n_users)]
+
+
+def generate_day(rng, output, day, users, songs, song_p, args, session_start):
+    '''
+    Writes one day of events to output/log_data/YYYY/MM/YYYY-MM-DD-events.json
+
+    Args:
+        rng: numpy random generator
+        output: output data directory
+        day: pandas Timestamp of the day
+        users: list of user dicts
+        songs: dataframe of the catalog
+        song_p: probability of each catalog song being played
+        args: generator arguments
+        session_start: first session ID of the day
+
+    Returns:
+        tuple of number of events written and next session ID
+    '''
+    day_ms = int(day.timestamp() * 1000)
+    titles, names, durations = songs['title'].values, songs['artist_name'].values, songs['duration'].values
+    other_p = np.array([w for *_, w in OTHER_PAGES], dtype=float)
+    other_p /= other_p.sum()
+
+    events = []
+    session_id = session_start
+    active = rng.random(len(users)) < args.active_rate
+    for user in (u for u, a in zip(users, active) if a):
+        for _ in range(1 + rng.poisson(0.5)):
+            # Session lengths are Zipf skewed, most sessions are short
+            length = int(min(rng.zipf(args.session_skew), args.max_session))
+            ts = day_ms + int(rng.integers(0, max(1, 86400000 - length * 300000)))
+            plays = rng.choice(len(songs), size=length, p=song_p)
+            for item in range(length):
+                event = {'artist': None, 'auth': 'Logged In',
+                         'firstName': user['firstName'], 'gender': user['gender'],
+                         'itemInSession': item, 'lastName': user['lastName'], 'length': None,
+                         'level': user['level'], 'location': user['location'],
+                         'method': 'PUT', 'page': 'NextSong',
+                         'registration': user['registration'], 'sessionId': session_id,
+                         'song': None, 'status': 200, 'ts': ts,
+                         'userAgent': user['userAgent'], 'userId': user['userId']}
+                if item == 0 or rng.random() < args.other_page_rate:
+                    page, method, status, _ = OTHER_PAGES[rng.choice(len(OTHER_PAGES), p=other_p)]
+                    event.update(page=page, method=method, status=status)
+                    ts += int(rng.integers(1000, 60000))
+                else:
+                    title, artist, duration = titles[plays[item]], names[plays[item]], durations[plays[item]]
+                    if rng.random() >= args.catalog_hit_rate:
+                        # Plays of tracks missing from the song data
+                        title, artist = random_title(rng), random_title(rng)
+                    event.update(artist=artist, song=title, length=float(duration))
+                    ts += int(duration * 1000)
+                events.append(event)
+            session_id += 1
+
+    events.sort(key=lambda e: e['ts'])
+    directory = os.path.join(output, 'log_data', f'{day.year:04d}', f'{day.month:02d}')
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f'{day:%Y-%m-%d}-events.json'), 'w') as f:
+        for event in events:
+            f.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+    return len(events), session_id
+
+
+def main():
+    '''
+    Generates a synthetic MusicStream data directory
+
+    Args:
+        None
+
+    Returns:
+        None
+    '''
+    parser = argparse.ArgumentParser(description='Generate synthetic MusicStream data files')
+    parser.add_argument('--output', default='data_synthetic',
+                        help='output directory, song_data and log_data are created in it')
+    parser.add_argument('--songs', type=int, default=1000, help='number of tracks')
+    parser.add_argument('--artists', type=int, help='number of artists (default songs / 4)')
+    parser.add_argument('--users', type=int, default=100, help='number of users')
+    parser.add_argument('--days', type=int, default=30, help='number of days of events')
+    parser.add_argument('--start-date', default='2018-11-01', help='first day of events')
+    parser.add_argument('--song-skew', type=float, default=1.1,
+                        help='Zipf exponent of song popularity')
+    parser.add_argument('--session-skew', type=float, default=1.6,
+                        help='Zipf exponent of session lengths')
+    parser.add_argument('--max-session', type=int, default=200,
+                        help='maximum number of events per session')
+    parser.add_argument('--active-rate', type=float, default=0.5,
+                        help='fraction of users active on a given day')
+    parser.add_argument('--other-page-rate', type=float, default=0.1,
+                        help='fraction of events that are not NextSong')
+    parser.add_argument('--catalog-hit-rate', type=float, default=0.9,
+                        help='fraction of plays of tracks present in song_data')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    start = pd.Timestamp(args.start_date)
+
+    songs = generate_songs(rng, args.output, args.songs, args.artists or max(1, args.songs // 4))
+    print(f'{len(songs)} song files written to {args.output}/song_data')
+
+    users = generate_users(rng, args.users, start)
+    song_p = zipf_probabilities(len(songs), args.song_skew)
+    # Popularity rank is independent of catalog order
+    song_p = song_p[rng.permutation(len(songs))]
+
+    total = 0
+    session_id = 1
+    for day in pd.date_range(start, periods=args.days, freq='D'):
+        n_events, session_id = generate_day(rng, args.output, day, users, songs, song_p,
+                                            args, session_id)
+        total += n_events
+    print(f'{total} events in {args.days} log files written to {args.output}/log_data')
+
+
+if __name__ == "__main__":
+    main()
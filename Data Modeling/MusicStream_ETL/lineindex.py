@@ -0,0 +1,104 @@
+# Sidecar index of the line offsets of log files, used to split
+# large files into line-aligned byte ranges without scanning them
+
+import os
+import mmap
+import numpy as np
+
+# Suffix of the index file written next to each log file
+INDEX_SUFFIX = '.idx'
+
+# Bytes of the file scanned for newlines at a time
+_SCAN_BYTES = 64 << 20
+
+def build_line_index(datafile):
+    '''
+    Finds the start offset of every line of a file, scanning
+    a memory map of it one block at a time
+
+    Args:
+        datafile: filepath to log file
+
+    Returns:
+        uint64 array of line start offsets, starting with 0
+    '''
+    size = os.path.getsize(datafile)
+    offsets = [np.zeros(1, dtype=np.uint64)]
+    if size == 0:
+        return offsets[0]
+
+    with open(datafile, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for start in range(0, size, _SCAN_BYTES):
+            block = np.frombuffer(mm, dtype=np.uint8, count=min(_SCAN_BYTES, size - start),
+                                  offset=start)
+            offsets.append(np.flatnonzero(block == ord('\n')).astype(np.uint64) + start + 1)
+            del block
+
+    offsets = np.concatenate(offsets)
+    # No line starts at the end of the file
+    return offsets[offsets < size]
+
+
+def load_line_index(datafile):
+    '''
+    Reads the line index of a file from its sidecar index file,
+    building and writing it if it is missing or older than the file.
+    The index is still returned if it cannot be written
+
+    Args:
+        datafile: filepath to log file
+
+    Returns:
+        uint64 array of line start offsets, starting with 0
+    '''
+    stat = os.stat(datafile)
+    index_file = datafile + INDEX_SUFFIX
+    # The index starts with the size and mtime of the file it indexes
+    header = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.uint64)
+    try:
+        stored = np.fromfile(index_file, dtype='<u8')
+        if len(stored) > 2 and np.array_equal(stored[:2], header):
+            return stored[2:]
+    except (OSError, ValueError):
+        pass
+
+    offsets = build_line_index(datafile)
+    try:
+        partial_file = index_file + '.tmp'
+        np.concatenate([header, offsets]).astype('<u8').tofile(partial_file)
+        os.replace(partial_file, index_file)
+    except OSError:
+        pass
+
+    return offsets
+
+
+def index_ranges(offsets, size, split_bytes):
+    '''
+    Splits a file into byte ranges of about split_bytes starting
+    on line boundaries, from its line index. Ranges are cut at the
+    same offsets as scheduler.line_ranges, each after the line
+    holding its split_bytes-th byte, so a load resumes on the same
+    ranges with or without the index
+
+    Args:
+        offsets: line start offsets from load_line_index
+        size: size of the file in bytes
+        split_bytes: target size of the ranges
+
+    Returns:
+        list of (start, end) tuples covering the file
+    '''
+    ranges = []
+    start = 0
+    while size - start > split_bytes:
+        # First line starting after the target byte
+        position = np.searchsorted(offsets, start + split_bytes, side='right')
+        if position >= len(offsets):
+            break
+        end = int(offsets[position])
+        ranges.append((start, end))
+        start = end
+    ranges.append((start, size))
+
+    return ranges
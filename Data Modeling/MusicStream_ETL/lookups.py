@@ -0,0 +1,252 @@
+# In-memory lookup structures used by the MusicStream ETL pipeline
+
+import numpy as np
+import pandas as pd
+from sql_queries import track_index_select, dimension_key_selects
+
+class TrackIndex:
+    '''
+    Index of tracks keyed on (title, artist name, duration), used to
+    resolve track_id and artist_id for log events without running the
+    a track search query once per event
+
+    Attributes:
+        hits: number of events resolved to a track
+        misses: number of events with no matching track
+    '''
+    key_columns = ['title', 'name', 'duration']
+    columns = key_columns + ['track_id', 'artist_id']
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # Typed like a flushed index, so that merging on it works before any track is added
+        self._index = pd.DataFrame({column: pd.Series(dtype=float if column == 'duration' else object)
+                                    for column in self.columns})
+        self._pending = []
+
+    def load(self, cur):
+        '''
+        Loads all tracks currently in the database into the index
+
+        Args:
+            cur: cursor to musicstream database
+
+        Returns:
+            None
+        '''
+        cur.execute(track_index_select)
+        self.add(pd.DataFrame(cur.fetchall(), columns=self.columns))
+
+    def add(self, df):
+        '''
+        Adds tracks to the index
+
+        Args:
+            df: dataframe with title, name, duration, track_id
+                and artist_id columns
+
+        Returns:
+            None
+        '''
+        if not df.empty:
+            self._pending.append(df[self.columns])
+
+    def _flush(self):
+        '''
+        Merges tracks added since the last lookup into the index.
+        The first track seen for a key wins
+        '''
+        if not self._pending:
+            return
+        # An empty index is left out, it only holds the column types
+        index = pd.concat(([self._index] if len(self._index) else []) + self._pending,
+                          ignore_index=True)
+        index['duration'] = index['duration'].astype(float)
+        index = index.dropna(subset=self.key_columns)
+        self._index = index.drop_duplicates(subset=self.key_columns)
+        self._pending = []
+
+    def resolve(self, df, title='song', name='artist', duration='length'):
+        '''
+        Resolves track_id and artist_id for every row of a log
+        dataframe with a single join against the index
+
+        Args:
+            df: dataframe of log events
+            title: column of df holding the track title
+            name: column of df holding the artist name
+            duration: column of df holding the track duration
+
+        Returns:
+            dataframe with track_id and artist_id columns, aligned
+            with the index of df (None where no track matched)
+        '''
+        self._flush()
+
+        if df.empty or self._index.empty:
+            self.misses += len(df)
+            return pd.DataFrame({'track_id': None, 'artist_id': None},
+                                index=df.index, dtype=object)
+
+        keys = pd.DataFrame({'title': df[title].values,
+                             'name': df[name].values,
+                             'duration': df[duration].values.astype(float)})
+        matched = keys.merge(self._index, how='left', on=self.key_columns)
+        matched.index = df.index
+
+        hits = int(matched['track_id'].notna().sum())
+        self.hits += hits
+        self.misses += len(matched) - hits
+
+        matched = matched[['track_id', 'artist_id']].astype(object)
+        return matched.where(matched.notna(), None)
+
+    @property
+    def match_rate(self):
+        '''
+        Fraction of resolved events that matched a track
+        '''
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        self._flush()
+        return len(self._index)
+
+
+class KeySet:
+    '''
+    Compact set of 64-bit keys, held in sorted NumPy arrays.
+    New keys go to small sorted runs that are merged into the
+    main array once they grow, so adding a batch of keys does
+    not copy the whole set
+    '''
+
+    def __init__(self, keys=()):
+        self._main = np.unique(np.asarray(keys, dtype=np.uint64))
+        self._runs = []
+
+    def __len__(self):
+        return len(self._main) + sum(len(run) for run in self._runs)
+
+    def contains(self, keys):
+        '''
+        Checks which keys are in the set
+
+        Args:
+            keys: array of uint64 keys
+
+        Returns:
+            boolean array, True where the key is in the set
+        '''
+        found = np.zeros(len(keys), dtype=bool)
+        for run in [self._main] + self._runs:
+            if len(run):
+                pos = np.minimum(np.searchsorted(run, keys), len(run) - 1)
+                found |= run[pos] == keys
+        return found
+
+    def add(self, keys):
+        '''
+        Adds keys to the set
+
+        Args:
+            keys: array of uint64 keys not already in the set
+
+        Returns:
+            None
+        '''
+        if not len(keys):
+            return
+        self._runs.append(np.unique(keys))
+
+        if len(self._runs) >= 16:
+            self._runs = [np.unique(np.concatenate(self._runs))]
+        if sum(len(run) for run in self._runs) > max(len(self._main) // 8, 4096):
+            self._main = np.union1d(self._main, np.concatenate(self._runs))
+            self._runs = []
+
+
+class DimensionKeys:
+    '''
+    Run-scoped record of the dimension keys already in the database,
+    so that rows of users, timetb, artists and tracks are only sent
+    when their key is new. Keys are stored as 64-bit integers, string
+    keys as 64-bit hashes
+
+    Attributes:
+        skipped: number of rows not sent, keyed on table
+    '''
+    # Key column of each dimension in the dataframes passed to new_rows
+    key_columns = {'users': 'userId', 'timetb': 'start_time',
+                   'artists': 'artist_id', 'tracks': 'song_id'}
+
+    def __init__(self):
+        self.skipped = {table: 0 for table in self.key_columns}
+        self._keys = {table: KeySet() for table in self.key_columns}
+
+    @staticmethod
+    def hash_keys(table, values):
+        '''
+        Converts dimension key values to uint64 keys
+
+        Args:
+            table: dimension table
+            values: series of key values
+
+        Returns:
+            array of uint64 keys
+        '''
+        if table == 'users':
+            return pd.to_numeric(values).astype('int64').values.astype(np.uint64)
+        if table == 'timetb':
+            return pd.to_datetime(values).values.astype('datetime64[ns]').view(np.uint64)
+        return pd.util.hash_array(np.asarray(values, dtype=object), categorize=False)
+
+    def load(self, cur):
+        '''
+        Seeds the key sets with the keys in the database
+
+        Args:
+            cur: cursor to musicstream database
+
+        Returns:
+            None
+        '''
+        for table, query in dimension_key_selects.items():
+            cur.execute(query)
+            values = pd.Series([row[0] for row in cur.fetchall()], dtype=object)
+            self._keys[table] = KeySet(self.hash_keys(table, values) if len(values) else ())
+
+    def new_rows(self, table, df):
+        '''
+        Drops the rows of a dimension dataframe whose key is already
+        loaded or repeated within the dataframe, keeping the first
+        row of a key as ON CONFLICT DO NOTHING would
+
+        Args:
+            table: dimension table
+            df: dataframe of dimension rows
+
+        Returns:
+            tuple of the new rows and their keys
+        '''
+        keys = self.hash_keys(table, df[self.key_columns[table]])
+        new = ~self._keys[table].contains(keys) & ~pd.Series(keys).duplicated().values
+        self.skipped[table] += int(len(df) - new.sum())
+
+        return df[new], keys[new]
+
+    def add(self, table, keys):
+        '''
+        Records keys as loaded
+
+        Args:
+            table: dimension table
+            keys: keys returned by new_rows, once the rows are loaded
+
+        Returns:
+            None
+        '''
+        self._keys[table].add(keys)
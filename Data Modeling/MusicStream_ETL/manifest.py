@@ -0,0 +1,252 @@
+# Load manifest recording which data files have been ingested
+
+import os
+import json
+import hashlib
+from sql_queries import load_manifest_table_create, load_manifest_select, load_manifest_upsert, \
+    load_progress_table_create, load_progress_select, load_progress_upsert, load_progress_delete, \
+    load_manifest_touch, bulk_load_queries
+from backends import default_backend
+
+def read_file_info(datafile):
+    '''
+    Helper function to read the manifest fields of a data file
+
+    Args:
+        datafile: filepath to data file
+
+    Returns:
+        dict with path, size, mtime and content hash of the file
+    '''
+    stat = os.stat(datafile)
+    md5 = hashlib.md5()
+    with open(datafile, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+
+    return {'path': datafile, 'size': stat.st_size,
+            'mtime': stat.st_mtime, 'hash': md5.hexdigest()}
+
+
+def content_info(datafile, stat, content):
+    '''
+    Helper function to build the manifest fields of a data file
+    from contents that were already read, without reading it again
+
+    Args:
+        datafile: filepath to data file
+        stat: os.stat result for the file
+        content: bytes of the file
+
+    Returns:
+        dict with path, size, mtime and content hash of the file
+    '''
+    return {'path': datafile, 'size': stat.st_size,
+            'mtime': stat.st_mtime, 'hash': hashlib.md5(content).hexdigest()}
+
+
+def count_rows(data):
+    '''
+    Helper function to count the rows loaded per table
+
+    Args:
+        data: dict of dataframes, keyed on target table
+
+    Returns:
+        dict of row counts, keyed on target table
+    '''
+    return {table: len(df) for table, df in data.items()
+            if table in bulk_load_queries}
+
+
+def transform_with_info(transform, datafile):
+    '''
+    Helper function running a transform function along with
+    read_file_info, so that hashing happens in the same
+    (possibly worker) process as parsing
+
+    Args:
+        transform: function reading a file into load-ready data
+        datafile: filepath to data file
+
+    Returns:
+        tuple of file info dict and transformed data
+    '''
+    return read_file_info(datafile), transform(datafile)
+
+
+class Manifest:
+    '''
+    Manifest of the data files loaded into the database, used to
+    only ingest files that are new or changed since the last run.
+    Files loaded in byte ranges also have their loaded ranges
+    recorded until the whole file is, to resume them mid-file
+
+    Attributes:
+        backend: storage Backend of the database, Postgres by default
+    '''
+
+    def __init__(self, backend=None):
+        self.backend = backend or default_backend
+        self._entries = {}
+        self._ranges = {}
+        self._touched = {}
+
+    def load(self, cur):
+        '''
+        Loads the manifest and the loaded ranges of partially
+        loaded files from the database, creating the tables if needed
+
+        Args:
+            cur: cursor to musicstream database
+
+        Returns:
+            None
+        '''
+        cur.execute(self.backend.translate(load_manifest_table_create))
+        cur.execute(load_manifest_select)
+        self._entries = {path: (size, mtime, content_hash)
+                         for path, size, mtime, content_hash in cur.fetchall()}
+
+        cur.execute(self.backend.translate(load_progress_table_create))
+        cur.execute(load_progress_select)
+        self._ranges = {}
+        for path, start, end, size, mtime, row_counts in cur.fetchall():
+            # jsonb is read back as text by the embedded backends
+            if isinstance(row_counts, str):
+                row_counts = json.loads(row_counts)
+            self._ranges.setdefault(path, {})[start] = (end, size, mtime, row_counts or {})
+
+    def get(self, datafile):
+        '''
+        Gets the manifest entry of a file
+
+        Args:
+            datafile: filepath to data file
+
+        Returns:
+            tuple of loaded size, mtime and content hash,
+            or None if the file is not in the manifest
+        '''
+        return self._entries.get(datafile)
+
+    def loaded_ranges(self, datafile, size, mtime):
+        '''
+        Gets the byte ranges of a file loaded by an earlier run
+        that did not finish it, if the file is unchanged since
+
+        Args:
+            datafile: filepath to data file
+            size: current size of the file
+            mtime: current mtime of the file
+
+        Returns:
+            dict of row counts dicts keyed on (start, end) tuples
+        '''
+        return {(start, end): row_counts
+                for start, (end, range_size, range_mtime, row_counts)
+                in self._ranges.get(datafile, {}).items()
+                if range_size == size and range_mtime == mtime}
+
+    def is_loaded(self, datafile):
+        '''
+        Checks whether a file is unchanged since it was loaded.
+        Size and mtime are compared first, the content hash is only
+        computed when they differ. The new mtime of a file touched
+        with its contents unchanged is kept to be recorded by select
+
+        Args:
+            datafile: filepath to data file
+
+        Returns:
+            True if the file does not need to be loaded again
+        '''
+        entry = self._entries.get(datafile)
+        if entry is None:
+            return False
+
+        size, mtime, content_hash = entry
+        stat = os.stat(datafile)
+        if stat.st_size != size:
+            return False
+        if stat.st_mtime == mtime:
+            return True
+
+        if read_file_info(datafile)['hash'] != content_hash:
+            return False
+        self._entries[datafile] = (size, stat.st_mtime, content_hash)
+        self._touched[datafile] = stat.st_mtime
+        return True
+
+    def select(self, files, full_refresh=False, cur=None):
+        '''
+        Selects the files that need to be loaded. If a cursor is given,
+        the new mtimes of touched but unchanged files are recorded, so
+        later runs skip them without hashing them again
+
+        Args:
+            files: list of filepaths
+            full_refresh: select all files regardless of the manifest
+            cur: cursor to musicstream database (optional), the
+                caller commits
+
+        Returns:
+            list of filepaths to load
+        '''
+        if full_refresh:
+            return list(files)
+        selected = [f for f in files if not self.is_loaded(f)]
+
+        if cur is not None:
+            for datafile, mtime in self._touched.items():
+                cur.execute(self.backend.translate(load_manifest_touch), (mtime, datafile))
+            self._touched = {}
+
+        return selected
+
+    def record(self, cur, info, data):
+        '''
+        Records a loaded file in the manifest. Run in the same
+        transaction as the load so both commit together
+
+        Args:
+            cur: cursor to musicstream database
+            info: file info dict from read_file_info, with the row
+                counts of the whole file under 'rows' if it was
+                loaded in ranges. For a range of a file, a dict with
+                path, size, mtime and the (start, end) range
+            data: dict of dataframes loaded from the file
+
+        Returns:
+            None
+        '''
+        if 'range' in info:
+            start, end = info['range']
+            self.backend.execute_values(cur, load_progress_upsert, [
+                (info['path'], start, end, info['size'], info['mtime'],
+                 json.dumps(count_rows(data)))])
+            self._ranges.setdefault(info['path'], {})[start] = \
+                (end, info['size'], info['mtime'], count_rows(data))
+            return
+
+        self.record_many(cur, [(info, info['rows'] if 'rows' in info else count_rows(data))])
+        if self._ranges.pop(info['path'], None) is not None:
+            cur.execute(self.backend.translate(load_progress_delete), (info['path'],))
+
+    def record_many(self, cur, entries):
+        '''
+        Records several loaded files in the manifest with one statement
+
+        Args:
+            cur: cursor to musicstream database
+            entries: list of (file info dict, row counts dict) tuples
+
+        Returns:
+            None
+        '''
+        rows = [(info['path'], info['size'], info['mtime'], info['hash'], json.dumps(row_counts))
+                for info, row_counts in entries]
+        self.backend.execute_values(cur, load_manifest_upsert, rows)
+
+        for info, _ in entries:
+            self._entries[info['path']] = (info['size'], info['mtime'], info['hash'])
@@ -0,0 +1,179 @@
+# Per-stage instrumentation of the MusicStream ETL pipeline
+
+import json
+import time
+from contextlib import contextmanager
+
+# Stages in pipeline order, used to order the summary
+STAGES = ['discovery', 'decode', 'transform', 'queue_wait', 'dimension_insert', 'track_lookup',
+          'fact_insert', 'aggregates', 'manifest', 'commit']
+
+class Metrics:
+    '''
+    Timing and counters per pipeline stage
+
+    Attributes:
+        stages: dict of counters keyed on stage name, each a dict with
+            seconds, calls, rows, bytes and round_trips
+    '''
+
+    def __init__(self):
+        self.stages = {}
+        self._current = None
+
+    def add(self, stage, seconds=0.0, calls=1, rows=0, bytes=0, round_trips=0):
+        '''
+        Adds to the counters of a stage
+
+        Args:
+            stage: stage name
+            seconds: time spent in the stage
+            calls: number of times the stage ran
+            rows: rows processed
+            bytes: bytes read
+            round_trips: database round trips
+
+        Returns:
+            None
+        '''
+        counters = self.stages.setdefault(stage, {'seconds': 0.0, 'calls': 0, 'rows': 0,
+                                                  'bytes': 0, 'round_trips': 0})
+        counters['seconds'] += seconds
+        counters['calls'] += calls
+        counters['rows'] += rows
+        counters['bytes'] += bytes
+        counters['round_trips'] += round_trips
+
+    @contextmanager
+    def timer(self, stage, rows=0, bytes=0):
+        '''
+        Context manager timing a stage. Yields a dict whose rows and
+        bytes entries can be updated once they are known
+
+        Args:
+            stage: stage name
+            rows: rows processed, if known up front
+            bytes: bytes read, if known up front
+        '''
+        counts = {'rows': rows, 'bytes': bytes}
+        previous, self._current = self._current, stage
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add(stage, time.perf_counter() - start, rows=counts['rows'], bytes=counts['bytes'])
+            self._current = previous
+
+    def round_trip(self):
+        '''
+        Counts a database round trip against the running stage
+        '''
+        self.add(self._current or 'other', calls=0, round_trips=1)
+
+    def merge(self, stages):
+        '''
+        Merges counters collected elsewhere, e.g. in a worker process
+
+        Args:
+            stages: dict of counters keyed on stage name
+
+        Returns:
+            None
+        '''
+        for stage, counters in stages.items():
+            self.add(stage, **counters)
+
+    def summary(self):
+        '''
+        Summarizes the counters of all stages
+
+        Returns:
+            list of dicts, one per stage, with rows_per_s added
+        '''
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        summary = []
+        for stage in sorted(self.stages, key=lambda s: order.get(s, len(STAGES))):
+            counters = dict(self.stages[stage], stage=stage)
+            counters['rows_per_s'] = counters['rows'] / counters['seconds'] if counters['seconds'] else 0.0
+            summary.append(counters)
+        return summary
+
+    def print_summary(self):
+        '''
+        Prints the summary as a table
+        '''
+        print(f'{"stage":<18}{"seconds":>10}{"calls":>9}{"rows":>11}{"rows/s":>12}'
+              f'{"MB read":>10}{"round trips":>13}')
+        for s in self.summary():
+            print(f'{s["stage"]:<18}{s["seconds"]:>10.3f}{s["calls"]:>9}{s["rows"]:>11}'
+                  f'{s["rows_per_s"]:>12.0f}{s["bytes"] / 1e6:>10.2f}{s["round_trips"]:>13}')
+
+    def write(self, path, format='jsonl'):
+        '''
+        Writes the summary to a file, appending one JSON line per stage
+        or overwriting a Prometheus text exposition file
+
+        Args:
+            path: filepath of the metrics file
+            format: 'jsonl' or 'prometheus'
+
+        Returns:
+            None
+        '''
+        summary = self.summary()
+        if format == 'jsonl':
+            run_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+            with open(path, 'a') as f:
+                for counters in summary:
+                    f.write(json.dumps(dict(counters, run_at=run_at)) + '\n')
+            return
+
+        lines = []
+        for name in ['seconds', 'calls', 'rows', 'rows_per_s', 'bytes', 'round_trips']:
+            metric = f'musicstream_etl_stage_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            for counters in summary:
+                lines.append(f'{metric}{{stage="{counters["stage"]}"}} {counters[name]}')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+# Metrics of the running process
+metrics = Metrics()
+
+# Cursor class of Postgres connections, defined on first use
+_counting_cursor = None
+
+def counting_cursor():
+    '''
+    Cursor class counting its database round trips in metrics, used
+    as cursor_factory of the musicstream connection. Defined on first
+    use, so that psycopg2 is only needed with the Postgres backend
+
+    Returns:
+        subclass of the psycopg2 cursor
+    '''
+    global _counting_cursor
+    if _counting_cursor is not None:
+        return _counting_cursor
+
+    from psycopg2.extensions import cursor
+
+    class CountingCursor(cursor):
+
+        def execute(self, query, vars=None):
+            metrics.round_trip()
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            vars_list = list(vars_list)
+            for _ in vars_list:
+                metrics.round_trip()
+            return super().executemany(query, vars_list)
+
+        def copy_expert(self, sql, file, size=8192):
+            metrics.round_trip()
+            return super().copy_expert(sql, file, size)
+
+    _counting_cursor = CountingCursor
+    return _counting_cursor
@@ -0,0 +1,170 @@
+# Range partitions of the trackplays table on start_time, created by
+# the loader as plays of new months or days arrive (Postgres only)
+
+import pandas as pd
+from backends import default_backend
+from sql_queries import trackplays_partitioning_select, trackplays_partitions_select, \
+    trackplays_partition_create, trackplays_partition_merge, trackplays_partition_detach, \
+    trackplays_partition_drop, unresolved_plays_partition_delete
+
+# Partition granularities and their pandas period frequencies
+PARTITION_GRANULARITIES = {'month': 'M', 'day': 'D'}
+
+# Date part of the partition names, e.g. trackplays_p201811
+_NAME_FORMATS = {'month': '%Y%m', 'day': '%Y%m%d'}
+
+_NAME_PREFIX = 'trackplays_p'
+
+class TrackplayPartitions:
+    '''
+    Partitions of a range partitioned trackplays table. Each batch
+    of plays is staged once and merged directly into the partitions
+    of its start times, which are created when first needed
+
+    Attributes:
+        granularity: 'month' or 'day', None if trackplays
+            is not partitioned
+        created: number of partitions created by this run
+    '''
+
+    def __init__(self):
+        self.granularity = None
+        self.created = 0
+        self._names = set()
+
+    def load(self, cur):
+        '''
+        Reads the granularity and the existing partitions of trackplays
+
+        Args:
+            cur: cursor to musicstream database
+
+        Returns:
+            None
+        '''
+        cur.execute(trackplays_partitioning_select)
+        row = cur.fetchone()
+        self.granularity = row[0] if row is not None else None
+        cur.execute(trackplays_partitions_select)
+        self._names = {row[0] for row in cur.fetchall()}
+
+    def name(self, period):
+        '''
+        Name of the partition of a month or day
+
+        Args:
+            period: pandas Period of the partition
+
+        Returns:
+            partition table name
+        '''
+        return _NAME_PREFIX + period.start_time.strftime(_NAME_FORMATS[self.granularity])
+
+    def period(self, name):
+        '''
+        Month or day of a partition, from its name
+
+        Args:
+            name: partition table name
+
+        Returns:
+            pandas Period, None if name is not a partition name
+        '''
+        if not name.startswith(_NAME_PREFIX):
+            return None
+        try:
+            start = pd.to_datetime(name[len(_NAME_PREFIX):], format=_NAME_FORMATS[self.granularity])
+        except ValueError:
+            return None
+        return start.to_period(PARTITION_GRANULARITIES[self.granularity])
+
+    def ensure(self, cur, period):
+        '''
+        Creates the partition of a month or day if it does not exist
+
+        Args:
+            cur: cursor to musicstream database
+            period: pandas Period of the partition
+
+        Returns:
+            partition table name
+        '''
+        name = self.name(period)
+        if name not in self._names:
+            cur.execute(trackplays_partition_create.format(name),
+                        (period.start_time.to_pydatetime(), (period + 1).start_time.to_pydatetime()))
+            self._names.add(name)
+            self.created += 1
+        return name
+
+    def load_df(self, cur, df, backend=None, returning=None):
+        '''
+        Bulk loads trackplays rows, COPY into the staging table once and
+        one INSERT ... SELECT ... ON CONFLICT DO NOTHING per partition
+
+        Args:
+            cur: cursor to musicstream database
+            df: dataframe of trackplays rows, with columns in
+                the same order as the table
+            backend: Postgres backend
+            returning: primary key column to return for the
+                inserted rows (optional)
+
+        Returns:
+            list of primary keys of the inserted rows if
+            returning is given, else None
+        '''
+        if df.empty:
+            return [] if returning is not None else None
+
+        backend = backend or default_backend
+        backend.stage_df(cur, 'trackplays', df)
+
+        inserted = []
+        periods = df['start_time'].dt.to_period(PARTITION_GRANULARITIES[self.granularity])
+        for period in sorted(periods.unique()):
+            merge = trackplays_partition_merge.format(self.ensure(cur, period))
+            if returning is not None:
+                merge = merge.rstrip().rstrip(';') + f' RETURNING {returning}'
+            cur.execute(merge, (period.start_time.to_pydatetime(),
+                                (period + 1).start_time.to_pydatetime()))
+            if returning is not None:
+                inserted.extend(row[0] for row in cur.fetchall())
+
+        return inserted if returning is not None else None
+
+    def remove_before(self, cur, conn, before, detach=False):
+        '''
+        Drops or detaches the partitions holding only plays before a
+        date, one transaction each, with the unresolved plays of the
+        removed plays, so reconcile.py only sees plays in trackplays.
+        Plays in the play count aggregates stay counted, until the
+        aggregates are rebuilt (create_tables.py --rebuild-aggregates)
+
+        Args:
+            cur: cursor to musicstream database
+            conn: connection to musicstream database
+            before: date, partitions ending on or before it are removed
+            detach: detach the partitions, keeping them as
+                standalone tables, instead of dropping them
+
+        Returns:
+            list of removed partition names
+        '''
+        before = pd.Timestamp(before)
+        removed = []
+        for name in sorted(self._names):
+            period = self.period(name)
+            if period is None or (period + 1).start_time > before:
+                continue
+
+            cur.execute(unresolved_plays_partition_delete.format(name))
+            if detach:
+                cur.execute(trackplays_partition_detach.format(name))
+            else:
+                cur.execute(trackplays_partition_drop.format(name))
+            conn.commit()
+            self._names.discard(name)
+            removed.append(name)
+
+        return removed
@@ -0,0 +1,134 @@
+# Concurrent read, transform and load pipeline of the MusicStream ETL
+
+import os
+import queue
+import threading
+from manifest import content_info
+
+# Default number of files held in each queue between stages
+PIPELINE_QUEUE_SIZE = 8
+
+# Seconds between checks for a stopped pipeline while a queue is full
+_POLL_INTERVAL = 0.1
+
+class _Failure:
+    '''
+    Wraps an exception raised in a pipeline stage, passed
+    downstream so that it is raised in the loading thread
+    '''
+
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+def _put(q, item, stop):
+    '''
+    Helper function putting an item on a bounded queue, waiting while
+    it is full unless the pipeline is stopped
+
+    Args:
+        q: queue to put the item on
+        item: item to put
+        stop: event set when the pipeline is stopped
+
+    Returns:
+        True if the item was put, False if the pipeline was stopped
+    '''
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_files(files, out, stop):
+    '''
+    Reader stage, reads the bytes of each file
+    '''
+    try:
+        for datafile in files:
+            with open(datafile, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                content = f.read()
+            if not _put(out, (datafile, stat, content), stop):
+                return
+    except Exception as e:
+        _put(out, _Failure(e), stop)
+        return
+    _put(out, _DONE, stop)
+
+
+def _transform_files(transform, source, out, stop):
+    '''
+    Transform stage, turns the bytes of each file into load-ready data
+    '''
+    while not stop.is_set():
+        try:
+            item = source.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if item is _DONE or isinstance(item, _Failure):
+            _put(out, item, stop)
+            return
+
+        datafile, stat, content = item
+        try:
+            info = content_info(datafile, stat, content)
+            data = transform(datafile, content=content)
+        except Exception as e:
+            _put(out, _Failure(e), stop)
+            return
+        if not _put(out, (info, data), stop):
+            return
+
+
+def pipeline(files, transform, queue_size=PIPELINE_QUEUE_SIZE, wait_timer=None):
+    '''
+    Reads and transforms files in background threads while the caller
+    loads them, so that reading, parsing and database writes overlap.
+    Stages are connected by bounded queues, a slow loader holds back
+    reading instead of letting parsed files pile up in memory
+
+    Args:
+        files: list of filepaths, yielded in this order
+        transform: function reading a file into load-ready data,
+            called as transform(datafile, content=bytes)
+        queue_size: number of files held in each queue
+        wait_timer: context manager factory timing the time spent
+            waiting on the transform stage (optional)
+
+    Returns:
+        generator of tuples of file info dict and transformed data
+    '''
+    stop = threading.Event()
+    read_queue = queue.Queue(maxsize=queue_size)
+    transform_queue = queue.Queue(maxsize=queue_size)
+    threads = [threading.Thread(target=_read_files, args=(files, read_queue, stop),
+                                name='pipeline-read', daemon=True),
+               threading.Thread(target=_transform_files,
+                                args=(transform, read_queue, transform_queue, stop),
+                                name='pipeline-transform', daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            if wait_timer is not None:
+                with wait_timer():
+                    item = transform_queue.get()
+            else:
+                item = transform_queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # Also reached when the loader fails or stops early
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,419 @@
+# Readers for the MusicStream song and log data files
+
+import io
+import os
+import gzip
+import json
+import queue
+import re
+import threading
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from concurrent.futures import ThreadPoolExecutor
+from manifest import content_info
+
+# orjson decodes several times faster than the json module, it is
+# used when installed and gives the same values
+try:
+    import orjson
+    decode_json = orjson.loads
+except ImportError:
+    decode_json = json.loads
+
+# Types of the fields of a log event
+EVENT_SCHEMA = {'artist': str, 'auth': str, 'firstName': str, 'gender': str,
+                'itemInSession': int, 'lastName': str, 'length': float, 'level': str,
+                'location': str, 'method': str, 'page': str, 'registration': float,
+                'sessionId': int, 'song': str, 'status': int, 'ts': int,
+                'userAgent': str, 'userId': int}
+
+# Types of the fields of a song record
+SONG_SCHEMA = {'num_songs': int, 'artist_id': str, 'artist_latitude': float,
+               'artist_longitude': float, 'artist_location': str, 'artist_name': str,
+               'song_id': str, 'title': str, 'duration': float, 'year': int}
+
+# Fields of a log event used by the ETL pipeline
+EVENT_FIELDS = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+                'level', 'location', 'sessionId', 'song', 'ts', 'userAgent', 'userId']
+
+# String fields of a log event with few distinct values, dictionary
+# encoded into categorical columns while decoding
+CATEGORICAL_FIELDS = ['gender', 'level', 'location', 'userAgent']
+
+# Fields of a song record
+SONG_FIELDS = ['num_songs', 'artist_id', 'artist_latitude', 'artist_longitude', 'artist_location',
+               'artist_name', 'song_id', 'title', 'duration', 'year']
+
+# Number of events per chunk yielded by read_events
+EVENT_CHUNKSIZE = 50000
+
+# Number of song files per batch yielded by read_song_batches
+SONG_BATCHSIZE = 5000
+
+# Number of threads reading song files
+SONG_READ_THREADS = 8
+
+# Suffixes of the data files, plain or compressed. Compressed
+# files are decompressed while they are read, never to disk
+DATA_SUFFIXES = ('.json', '.json.gz', '.json.zst')
+
+# Bytes decompressed at a time, and chunks held ahead of the
+# parser, when decompressing in a separate thread
+DECOMPRESS_CHUNKSIZE = 1 << 20
+DECOMPRESS_QUEUE_SIZE = 8
+
+# A line of a buffer, the last one possibly without a newline
+_LINE = re.compile(rb'[^\n]*\n|[^\n]+')
+
+class CategoryDictionary:
+    '''
+    Dictionary encoding of string fields with few distinct values,
+    shared by every file read in a process during a run. Columns of
+    these fields are categoricals coded against the same growing list
+    of values, so each string is held once and deduplication and
+    comparisons work on small integer codes
+
+    Attributes:
+        fields: encoded fields
+    '''
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        # None is coded -1, the null code of categoricals
+        self._codes = {field: {None: -1} for field in self.fields}
+        self._values = {field: [] for field in self.fields}
+        self._dtypes = {}
+
+    def __contains__(self, field):
+        return field in self._codes
+
+    def dtype(self, field):
+        '''
+        Categorical dtype of a field, over the values seen so far
+
+        Args:
+            field: encoded field
+
+        Returns:
+            pandas CategoricalDtype
+        '''
+        dtype = self._dtypes.get(field)
+        if dtype is None or len(dtype.categories) != len(self._values[field]):
+            dtype = pd.CategoricalDtype(pd.Index(self._values[field], dtype=object))
+            self._dtypes[field] = dtype
+        return dtype
+
+    def encode(self, field, values):
+        '''
+        Converts the decoded values of a field to a categorical,
+        adding values not seen before to the dictionary
+
+        Args:
+            field: encoded field
+            values: sequence of decoded values
+
+        Returns:
+            pandas Categorical
+        '''
+        codes = self._codes[field]
+        known = self._values[field]
+        for value in dict.fromkeys(values):
+            if value not in codes:
+                codes[value] = len(known)
+                known.append(value)
+
+        encoded = np.fromiter(map(codes.__getitem__, values), dtype=np.int32, count=len(values))
+        return pd.Categorical.from_codes(encoded, dtype=self.dtype(field))
+
+
+# Dictionary of the categorical event fields of this run
+event_categories = CategoryDictionary(CATEGORICAL_FIELDS)
+
+def typed_column(values, kind):
+    '''
+    Converts the decoded values of a field to an array of its type.
+    Nulls are converted here once: NaN in float columns, <NA> in
+    integer columns (which are then nullable Int64) and None in
+    string columns
+
+    Args:
+        values: sequence of decoded values
+        kind: type of the field, str, int or float
+
+    Returns:
+        numpy array, or pandas Int64 array for integers with nulls
+    '''
+    if kind is str:
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+
+    try:
+        return np.array(values, dtype=np.int64 if kind is int else np.float64)
+    except (TypeError, ValueError):
+        # Nulls in an integer field, or numbers held in strings
+        # that are not valid numbers, e.g. empty user IDs
+        column = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce')
+        return column.astype('Int64').array if kind is int else column.values
+
+
+def typed_frame(records, fields, schema, index=None, categories=None):
+    '''
+    Builds a dataframe of typed columns from decoded records
+
+    Args:
+        records: list of records, one list of field values each
+        fields: fields of the records
+        schema: dict of field types, e.g. EVENT_SCHEMA
+        index: index of the dataframe (optional)
+        categories: CategoryDictionary encoding some of the
+            fields as categoricals (optional)
+
+    Returns:
+        dataframe with one typed column per field
+    '''
+    columns = list(zip(*records)) if records else [()] * len(fields)
+
+    return pd.DataFrame({field: categories.encode(field, values)
+                         if categories is not None and field in categories
+                         else typed_column(values, schema[field])
+                         for field, values in zip(fields, columns)},
+                        columns=fields, index=index)
+
+
+def concat_frames(frames, ignore_index=False):
+    '''
+    Concatenates dataframes of the same columns. Categorical columns
+    stay categorical when their categories differ, e.g. when the
+    dictionary grew between chunks, instead of falling back to strings
+
+    Args:
+        frames: list of dataframes
+        ignore_index: number the rows of the result from 0
+
+    Returns:
+        dataframe
+    '''
+    df = pd.concat(frames, ignore_index=ignore_index)
+    for column, dtype in frames[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype) and \
+                not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = union_categoricals([frame[column] for frame in frames])
+
+    return df
+
+
+def is_compressed(datafile):
+    '''
+    Checks whether a data file is gzip or zstd compressed, from its name
+
+    Args:
+        datafile: filepath to data file
+
+    Returns:
+        True if the file is compressed
+    '''
+    return datafile.endswith(('.gz', '.zst'))
+
+
+def decompressed(datafile, raw):
+    '''
+    Wraps a binary file object of the bytes of a data file in a
+    reader streaming their decompressed bytes, if it is compressed
+
+    Args:
+        datafile: filepath to data file
+        raw: binary file object of the bytes of the file
+
+    Returns:
+        binary file object
+    '''
+    if datafile.endswith('.gz'):
+        return gzip.GzipFile(fileobj=raw)
+    if datafile.endswith('.zst'):
+        # Optional dependency, only needed for zstd files
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw))
+    return raw
+
+
+def _threaded_lines(stream, chunksize=DECOMPRESS_CHUNKSIZE, queue_size=DECOMPRESS_QUEUE_SIZE):
+    '''
+    Helper function splitting a stream into lines, with the stream
+    read (and decompressed) by a background thread so that it
+    overlaps with decoding the lines. gzip and zstd release the GIL
+    while decompressing
+    '''
+    chunks = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Gives up once the lines are no longer consumed
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read():
+        try:
+            while not stop.is_set():
+                chunk = stream.read(chunksize)
+                put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=read, name='decompress', daemon=True)
+    thread.start()
+    try:
+        rest = b''
+        while True:
+            chunk = chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+            yield from lines
+        if rest:
+            yield rest
+    finally:
+        stop.set()
+        thread.join()
+
+
+def read_lines(datafile, content=None, threaded=False):
+    '''
+    Streams the lines of a plain or compressed data file
+
+    Args:
+        datafile: filepath to data file
+        content: bytes of the file, if already read, or a memoryview
+            of a range of lines of a plain file
+        threaded: decompress in a separate thread
+
+    Returns:
+        generator of lines as bytes
+    '''
+    if isinstance(content, memoryview):
+        # Lines are copied out of the view one at a time,
+        # the range as a whole is never copied
+        for line in _LINE.finditer(content):
+            yield line.group()
+        return
+
+    with open(datafile, 'rb') if content is None else io.BytesIO(content) as raw:
+        with decompressed(datafile, raw) as stream:
+            if threaded and is_compressed(datafile):
+                yield from _threaded_lines(stream)
+            else:
+                yield from stream
+
+
+def read_events(datafile, chunksize=EVENT_CHUNKSIZE, fields=EVENT_FIELDS, content=None,
+                threaded=False, categories=event_categories):
+    '''
+    Streams NextSong events from a JSON lines log file, plain or compressed.
+    Lines are filtered on the page field while decoding and only
+    the given fields are kept, so non NextSong events never reach
+    a dataframe and a file is never held in memory as a whole.
+    Columns are typed as in EVENT_SCHEMA, with the categorical
+    fields dictionary encoded
+
+    Args:
+        datafile: filepath to log file
+        chunksize: maximum number of events per dataframe
+        fields: event fields to keep
+        content: bytes of the file, if already read
+        threaded: decompress a compressed file in a separate thread
+        categories: CategoryDictionary of the categorical fields,
+            None to keep them as strings
+
+    Returns:
+        generator of dataframes of NextSong events, indexed
+        by line number in the file
+    '''
+    records = []
+    line_numbers = []
+
+    for line_number, line in enumerate(read_lines(datafile, content, threaded)):
+        # Cheap check on the raw bytes before decoding the line
+        if b'NextSong' not in line:
+            continue
+
+        event = decode_json(line)
+        if event.get('page') != 'NextSong':
+            continue
+
+        records.append([event.get(field) for field in fields])
+        line_numbers.append(line_number)
+
+        if len(records) >= chunksize:
+            yield typed_frame(records, fields, EVENT_SCHEMA, line_numbers, categories)
+            records = []
+            line_numbers = []
+
+    if records:
+        yield typed_frame(records, fields, EVENT_SCHEMA, line_numbers, categories)
+
+
+def read_song_file(datafile, content=None):
+    '''
+    Reads the song records of a song file with a plain JSON decode,
+    which is much cheaper than pd.read_json for one-record files
+
+    Args:
+        datafile: filepath to song data file
+        content: bytes of the file, if already read
+
+    Returns:
+        tuple of file info dict (see manifest.read_file_info) and
+        list of song records, one list of SONG_FIELDS values each
+    '''
+    if content is None:
+        with open(datafile, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            content = f.read()
+    else:
+        stat = os.stat(datafile)
+
+    records = []
+    for line in read_lines(datafile, content):
+        if line.strip():
+            song = decode_json(line)
+            records.append([song.get(field) for field in SONG_FIELDS])
+
+    return content_info(datafile, stat, content), records
+
+
+def read_song_batches(files, batchsize=SONG_BATCHSIZE, threads=SONG_READ_THREADS):
+    '''
+    Reads song files concurrently with a thread pool and collects
+    them into one columnar batch per batchsize files
+
+    Args:
+        files: list of filepaths to song data files
+        batchsize: number of files per batch
+        threads: number of threads reading files
+
+    Returns:
+        generator of (list of file info dicts, dataframe of songs
+        typed as in SONG_SCHEMA, list of song record counts per
+        file) tuples, in file order
+    '''
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for start in range(0, len(files), batchsize):
+            infos = []
+            counts = []
+            records = []
+            for info, file_records in pool.map(read_song_file, files[start:start + batchsize]):
+                infos.append(info)
+                counts.append(len(file_records))
+                records.extend(file_records)
+
+            yield infos, typed_frame(records, SONG_FIELDS, SONG_SCHEMA), counts
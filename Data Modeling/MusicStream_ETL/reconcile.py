@@ -0,0 +1,123 @@
+# Resolves the track and artist of plays loaded before their song
+# Run after loading new song files, instead of reloading the logs
+
+import time
+import argparse
+from backends import BACKENDS, get_backend, default_backend
+from aggregates import create_aggregate_tables
+from sql_queries import unresolved_plays_table_create, unresolved_chunk_end, unresolved_count, \
+    trackplays_reconcile, reconciled_plays_by_track_day, unresolved_plays_delete, \
+    aggregate_queries
+
+# Default number of unresolved plays per chunk
+RECONCILE_CHUNKSIZE = 50000
+
+def reconcile_chunk(cur, start, end, backend=None):
+    '''
+    Resolves the unresolved plays with trackplay_id in [start, end]
+    against the current tracks and artists, with one UPDATE ... FROM.
+    Resolved plays are added to plays_by_track_day and removed
+    from unresolved_plays
+
+    Args:
+        cur: cursor to musicstream database
+        start: first trackplay_id of the chunk
+        end: last trackplay_id of the chunk
+        backend: storage Backend, Postgres if not given
+
+    Returns:
+        number of plays resolved
+    '''
+    backend = backend or default_backend
+
+    cur.execute(backend.translate(trackplays_reconcile), (start, end))
+
+    cur.execute(backend.translate(reconciled_plays_by_track_day), (start, end))
+    deltas = cur.fetchall()
+    backend.execute_values(cur, aggregate_queries['plays_by_track_day'][1], deltas)
+
+    cur.execute(backend.translate(unresolved_plays_delete), (start, end, start, end))
+
+    return sum(plays for track_id, day, plays in deltas)
+
+
+def reconcile_plays(cur, conn, chunksize=RECONCILE_CHUNKSIZE, backend=None):
+    '''
+    Resolves all unresolved plays, one chunk at a time in
+    trackplay_id order, committing after each chunk
+
+    Args:
+        cur: cursor to musicstream database
+        conn: connection to musicstream database
+        chunksize: number of unresolved plays per chunk
+        backend: storage Backend, Postgres if not given
+
+    Returns:
+        tuple of number of plays resolved and still unresolved
+    '''
+    backend = backend or default_backend
+    cur.execute(backend.translate(unresolved_plays_table_create))
+    create_aggregate_tables(cur, backend)
+
+    cur.execute(unresolved_count)
+    total = cur.fetchone()[0]
+    print(f'{total} unresolved plays')
+
+    # trackplay_id is a signed 64-bit hash
+    start = -2 ** 63
+    scanned = 0
+    resolved = 0
+    started_at = time.perf_counter()
+    while scanned < total:
+        cur.execute(backend.translate(unresolved_chunk_end), (start, chunksize))
+        end = cur.fetchone()[0]
+        if end is None:
+            break
+
+        resolved += reconcile_chunk(cur, start, end, backend)
+        conn.commit()
+
+        scanned = min(total, scanned + chunksize)
+        elapsed = time.perf_counter() - started_at
+        print(f'{scanned}/{total} plays checked, {resolved} resolved '
+              f'({scanned / elapsed:.0f} plays/s)')
+        if end == 2 ** 63 - 1:
+            break
+        start = end + 1
+
+    return resolved, total - resolved
+
+
+def main():
+    '''
+    Resolves the unresolved plays of the MusicStream database
+
+    Args:
+        None
+
+    Returns:
+        None
+    '''
+    parser = argparse.ArgumentParser(description='Resolve the track and artist of plays '
+                                                 'loaded before their song')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='postgres',
+                        help='storage backend of the MusicStream database')
+    parser.add_argument('--database',
+                        help='connection string (postgres) or database file (sqlite, duckdb), '
+                             'the backend default if not given')
+    parser.add_argument('--chunk-size', type=int, default=RECONCILE_CHUNKSIZE,
+                        help='number of unresolved plays per transaction')
+    args = parser.parse_args()
+
+    backend = get_backend(args.backend, args.database)
+    conn = backend.connect()
+    cur = conn.cursor()
+
+    resolved, remaining = reconcile_plays(cur, conn, args.chunk_size, backend)
+    print(f'{resolved} plays resolved, {remaining} still unresolved')
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
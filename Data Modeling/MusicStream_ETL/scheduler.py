@@ -0,0 +1,239 @@
+# Size-aware scheduling of file transforms over a process pool
+# Files are transformed longest first, very large log files in
+# line-aligned byte ranges, and loaded as they complete
+
+import os
+import mmap
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from manifest import content_info, read_file_info, count_rows
+from lineindex import load_line_index, index_ranges
+from readers import is_compressed
+
+# Default size above which log files are split into byte ranges
+SPLIT_BYTES = 64 << 20
+
+# Tasks in flight per worker, so workers never wait on the loader
+# to hand out work while parsed files do not pile up in memory
+_TASKS_PER_WORKER = 2
+
+# Hashing a file for the manifest is about this many times
+# cheaper than parsing it
+_HASH_COST = 0.1
+
+# Compressed JSON logs parse to about this many times their size
+_COMPRESSION_RATIO = 8
+
+class Task:
+    '''
+    Unit of work of the scheduler: transforming a whole file or
+    a byte range of it, or hashing a file loaded in ranges
+
+    Attributes:
+        path: filepath to data file
+        kind: 'file', 'range' or 'hash'
+        start: first byte of the range
+        end: byte after the range
+        size: size of the file when the task was planned
+        mtime: mtime of the file when the task was planned
+        cost: estimated cost, in bytes parsed
+    '''
+
+    def __init__(self, path, kind, start, end, stat):
+        self.path = path
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.cost = (end - start) * (_HASH_COST if kind == 'hash' else 1)
+        if kind == 'file' and is_compressed(path):
+            self.cost *= _COMPRESSION_RATIO
+
+
+def line_ranges(datafile, size, split_bytes):
+    '''
+    Splits a file into byte ranges of about split_bytes,
+    each ending after a newline
+
+    Args:
+        datafile: filepath to data file
+        size: size of the file in bytes
+        split_bytes: target size of the ranges
+
+    Returns:
+        list of (start, end) tuples covering the file
+    '''
+    ranges = []
+    start = 0
+    with open(datafile, 'rb') as f:
+        while size - start > split_bytes:
+            f.seek(start + split_bytes)
+            f.readline()
+            end = f.tell()
+            if end >= size:
+                break
+            ranges.append((start, end))
+            start = end
+    ranges.append((start, size))
+
+    return ranges
+
+
+def plan_tasks(files, split_bytes=None, manifest=None, line_index=False):
+    '''
+    Builds the tasks of a list of files, longest first. Files larger
+    than split_bytes get one task per line-aligned range and a task
+    hashing the whole file for the manifest. Ranges loaded by an
+    earlier run that did not finish the file are skipped. Compressed
+    files cannot be read from an offset and are never split
+
+    Args:
+        files: list of filepaths
+        split_bytes: size above which files are split (optional)
+        manifest: Manifest of the loaded ranges (optional)
+        line_index: find the ranges with the sidecar line index
+            of each file instead of seeking to each boundary
+
+    Returns:
+        tuple of list of Tasks, in decreasing cost order, and dict
+        of the row counts of the skipped ranges, keyed on path
+    '''
+    tasks = []
+    loaded = {}
+    for datafile in files:
+        stat = os.stat(datafile)
+        size = stat.st_size
+        if not split_bytes or size <= split_bytes or is_compressed(datafile):
+            tasks.append(Task(datafile, 'file', 0, size, stat))
+            continue
+
+        if line_index:
+            ranges = index_ranges(load_line_index(datafile), size, split_bytes)
+        else:
+            ranges = line_ranges(datafile, size, split_bytes)
+        done = manifest.loaded_ranges(datafile, size, stat.st_mtime) if manifest else {}
+        counts = loaded.setdefault(datafile, {})
+        for start, end in ranges:
+            if (start, end) in done:
+                for table, n in done[start, end].items():
+                    counts[table] = counts.get(table, 0) + n
+            else:
+                tasks.append(Task(datafile, 'range', start, end, stat))
+        tasks.append(Task(datafile, 'hash', 0, size, stat))
+
+    return sorted(tasks, key=lambda task: task.cost, reverse=True), loaded
+
+
+def run_task(transform, task):
+    '''
+    Runs a task in a worker process
+
+    Args:
+        transform: function reading a file into load-ready data,
+            called as transform(datafile, content=bytes), with a
+            memoryview of the range as content for ranges
+        task: Task to run
+
+    Returns:
+        tuple of task, worker pid, busy seconds, file info dict
+        (range info for ranges) and transformed data (None for hashes)
+    '''
+    started = time.perf_counter()
+    data = None
+    if task.kind == 'hash':
+        info = read_file_info(task.path)
+    elif task.kind == 'range':
+        # Workers map the file and parse their range in place in the
+        # shared page cache, no worker copies the range or reads the
+        # whole file. The view keeps the map alive until it is freed
+        with open(task.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        content = memoryview(mm)[task.start:task.end]
+        info = {'path': task.path, 'size': task.size, 'mtime': task.mtime,
+                'range': (task.start, task.end)}
+        data = transform(task.path, content=content)
+        del content, mm
+    else:
+        with open(task.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            content = f.read()
+        info = content_info(task.path, stat, content)
+        data = transform(task.path, content=content)
+
+    return task, os.getpid(), time.perf_counter() - started, info, data
+
+
+def schedule(files, transform, workers, split_bytes=None, manifest=None, line_index=False):
+    '''
+    Transforms files in a process pool, handing out the largest
+    remaining task whenever a worker frees up, and yields each
+    file as soon as it is transformed, in completion order. Prints
+    the utilization of each worker when done
+
+    Args:
+        files: list of filepaths
+        transform: function reading a file into load-ready data,
+            called as transform(datafile, content=bytes)
+        workers: number of worker processes
+        split_bytes: size above which files are split (optional)
+        manifest: Manifest of the ranges loaded by an earlier
+            run, which are not loaded again (optional)
+        line_index: split files with their sidecar line index
+
+    Returns:
+        generator of tuples of file info dict and transformed data.
+        For a file loaded in ranges, info is the range info (see
+        run_task) for all but the range completing it, whose info
+        is the file info with the row counts of all ranges under
+        'rows'. data is None if the file is completed by its hash
+    '''
+    tasks, rows = plan_tasks(files, split_bytes, manifest, line_index)
+    pending = {}
+    for task in tasks:
+        pending[task.path] = pending.get(task.path, 0) + 1
+    infos = {}
+    usage = {}
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        queued = iter(tasks)
+        running = set()
+        while True:
+            for task in queued:
+                running.add(pool.submit(run_task, transform, task))
+                if len(running) >= workers * _TASKS_PER_WORKER:
+                    break
+            if not running:
+                break
+
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, pid, busy, info, data = future.result()
+                tasks_run, size, total = usage.get(pid, (0, 0, 0.0))
+                usage[pid] = (tasks_run + 1, size + task.end - task.start, total + busy)
+
+                if task.kind == 'file':
+                    yield info, data
+                    continue
+                if task.kind == 'hash':
+                    infos[task.path] = info
+                else:
+                    counts = rows[task.path]
+                    for table, n in count_rows(data).items():
+                        counts[table] = counts.get(table, 0) + n
+
+                pending[task.path] -= 1
+                if pending[task.path] > 0 and data is not None:
+                    yield info, data
+                elif pending[task.path] == 0:
+                    # Earlier ranges are loaded by now, a hash completing
+                    # the file is recorded with no data of its own
+                    yield dict(infos.pop(task.path), rows=rows.pop(task.path, {})), data
+
+    elapsed = time.perf_counter() - started
+    for pid, (tasks_run, size, busy) in sorted(usage.items()):
+        print(f'Worker {pid}: {tasks_run} tasks, {size / 1e6:.1f} MB, '
+              f'busy {busy:.2f}s of {elapsed:.2f}s ({busy / elapsed:.0%})')
+    busy = sum(total for tasks_run, size, total in usage.values())
+    print(f'Worker utilization: {busy / (workers * elapsed):.0%} over {elapsed:.2f}s')
@@ -4,18 +4,39 @@
 # Fact table
 trackplays_table_create = ("""
     CREATE TABLE IF NOT EXISTS trackplays
-    (trackplay_id int PRIMARY KEY,
-     start_time timestamp REFERENCES timetb(start_time),
-     user_id int NOT NULL REFERENCES users(user_id),
+    (trackplay_id bigint PRIMARY KEY,
+     start_time timestamp,
+     user_id int NOT NULL,
      tier text,
-     track_id text REFERENCES tracks(track_id),
-     artist_id text REFERENCES artists(artist_id),
+     track_id text,
+     artist_id text,
      session_id int,
+     item_in_session int,
      location text,
      user_agent text
      )
 """)
 
+# Fact table range partitioned on start_time, created instead of
+# trackplays_table_create by create_tables.py --partition. The
+# primary key of a partitioned table includes the partition key,
+# start_time is part of the hashed event key so it is as unique
+trackplays_partitioned_table_create = ("""
+    CREATE TABLE IF NOT EXISTS trackplays
+    (trackplay_id bigint,
+     start_time timestamp NOT NULL,
+     user_id int NOT NULL,
+     tier text,
+     track_id text,
+     artist_id text,
+     session_id int,
+     item_in_session int,
+     location text,
+     user_agent text,
+     PRIMARY KEY (trackplay_id, start_time)
+     ) PARTITION BY RANGE (start_time)
+""")
+
 # Dimension tables
 users_table_create = ("""
     CREATE TABLE IF NOT EXISTS users
@@ -31,7 +52,7 @@ tracks_table_create = ("""
     CREATE TABLE IF NOT EXISTS tracks
     (track_id text PRIMARY KEY,
      title text NOT NULL,
-     artist_id text NOT NULL REFERENCES artists(artist_id),
+     artist_id text NOT NULL,
      year int,
      duration numeric NOT NULL
      )
@@ -59,12 +80,167 @@ timetb_table_create = ("""
      )
 """)
 
+# Foreign keys
+# Added once the tables exist, or after loading in bulk-load mode,
+# as (table, constraint name, ADD CONSTRAINT query)
+trackplays_start_time_fkey = ("""
+    ALTER TABLE trackplays ADD CONSTRAINT trackplays_start_time_fkey
+    FOREIGN KEY (start_time) REFERENCES timetb(start_time)
+""")
+
+trackplays_user_id_fkey = ("""
+    ALTER TABLE trackplays ADD CONSTRAINT trackplays_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+""")
+
+trackplays_track_id_fkey = ("""
+    ALTER TABLE trackplays ADD CONSTRAINT trackplays_track_id_fkey
+    FOREIGN KEY (track_id) REFERENCES tracks(track_id)
+""")
+
+trackplays_artist_id_fkey = ("""
+    ALTER TABLE trackplays ADD CONSTRAINT trackplays_artist_id_fkey
+    FOREIGN KEY (artist_id) REFERENCES artists(artist_id)
+""")
+
+tracks_artist_id_fkey = ("""
+    ALTER TABLE tracks ADD CONSTRAINT tracks_artist_id_fkey
+    FOREIGN KEY (artist_id) REFERENCES artists(artist_id)
+""")
+
+foreign_keys = [
+    ('tracks', 'tracks_artist_id_fkey', tracks_artist_id_fkey),
+    ('trackplays', 'trackplays_start_time_fkey', trackplays_start_time_fkey),
+    ('trackplays', 'trackplays_user_id_fkey', trackplays_user_id_fkey),
+    ('trackplays', 'trackplays_track_id_fkey', trackplays_track_id_fkey),
+    ('trackplays', 'trackplays_artist_id_fkey', trackplays_artist_id_fkey)
+]
+
+validate_constraint = "ALTER TABLE {} VALIDATE CONSTRAINT {}"
+
+foreign_keys_select = ("""
+    SELECT conname, convalidated FROM pg_constraint WHERE contype = 'f'
+""")
+
+# Rows violating each foreign key, counted in one scan per referencing table
+trackplays_fkey_violations = ("""
+    SELECT
+        count(*) FILTER (WHERE tp.start_time IS NOT NULL AND t.start_time IS NULL)
+            AS trackplays_start_time_fkey,
+        count(*) FILTER (WHERE u.user_id IS NULL)
+            AS trackplays_user_id_fkey,
+        count(*) FILTER (WHERE tp.track_id IS NOT NULL AND tr.track_id IS NULL)
+            AS trackplays_track_id_fkey,
+        count(*) FILTER (WHERE tp.artist_id IS NOT NULL AND a.artist_id IS NULL)
+            AS trackplays_artist_id_fkey
+    FROM trackplays tp
+    LEFT JOIN timetb t ON t.start_time = tp.start_time
+    LEFT JOIN users u ON u.user_id = tp.user_id
+    LEFT JOIN tracks tr ON tr.track_id = tp.track_id
+    LEFT JOIN artists a ON a.artist_id = tp.artist_id
+""")
+
+tracks_fkey_violations = ("""
+    SELECT
+        count(*) FILTER (WHERE a.artist_id IS NULL) AS tracks_artist_id_fkey
+    FROM tracks tr
+    LEFT JOIN artists a ON a.artist_id = tr.artist_id
+""")
+
+fkey_violation_queries = [tracks_fkey_violations, trackplays_fkey_violations]
+
+# Bulk-load mode
+# Tables holding unlogged data, and the query making them logged
+unlogged_tables_select = ("""
+    SELECT relname FROM pg_class
+    WHERE relpersistence = 'u' AND relkind = 'r'
+    AND relname IN ('timetb', 'users', 'artists', 'tracks', 'trackplays', 'load_manifest',
+                    'load_progress', 'unresolved_plays', 'plays_by_hour_tier',
+                    'plays_by_track_day', 'plays_by_user_day')
+""")
+
+set_logged = "ALTER TABLE {} SET LOGGED"
+
+relaxed_commit = "SET synchronous_commit TO off"
+
+# Load manifest, one row per ingested data file
+load_manifest_table_create = ("""
+    CREATE TABLE IF NOT EXISTS load_manifest
+    (file_path text PRIMARY KEY,
+     file_size bigint NOT NULL,
+     file_mtime double precision NOT NULL,
+     content_hash text NOT NULL,
+     row_counts jsonb,
+     loaded_at timestamp NOT NULL DEFAULT now()
+     )
+""")
+
+# Byte ranges of partially loaded files, one row per loaded range,
+# so that an interrupted load of a large file resumes mid-file
+load_progress_table_create = ("""
+    CREATE TABLE IF NOT EXISTS load_progress
+    (file_path text,
+     range_start bigint,
+     range_end bigint NOT NULL,
+     file_size bigint NOT NULL,
+     file_mtime double precision NOT NULL,
+     row_counts jsonb,
+     PRIMARY KEY (file_path, range_start)
+     )
+""")
+
+# Plays whose track was not found at load time, with the fields
+# needed to resolve them later (see reconcile.py)
+unresolved_plays_table_create = ("""
+    CREATE TABLE IF NOT EXISTS unresolved_plays
+    (trackplay_id bigint PRIMARY KEY,
+     song text,
+     artist text,
+     length numeric
+     )
+""")
+
+# Play count aggregates, kept up to date from each batch of new plays
+# so that dashboards do not scan the fact table
+plays_by_hour_tier_table_create = ("""
+    CREATE TABLE IF NOT EXISTS plays_by_hour_tier
+    (hour timestamp,
+     tier text,
+     plays bigint NOT NULL,
+     PRIMARY KEY (hour, tier)
+     )
+""")
+
+plays_by_track_day_table_create = ("""
+    CREATE TABLE IF NOT EXISTS plays_by_track_day
+    (track_id text,
+     day date,
+     plays bigint NOT NULL,
+     PRIMARY KEY (track_id, day)
+     )
+""")
+
+plays_by_user_day_table_create = ("""
+    CREATE TABLE IF NOT EXISTS plays_by_user_day
+    (user_id int,
+     day date,
+     plays bigint NOT NULL,
+     PRIMARY KEY (user_id, day)
+     )
+""")
+
 # Drop tables
 trackplays_table_drop = "DROP TABLE IF EXISTS trackplays"
 users_table_drop = "DROP TABLE IF EXISTS users"
 tracks_table_drop = "DROP TABLE IF EXISTS tracks"
 artists_table_drop = "DROP TABLE IF EXISTS artists"
 timetb_table_drop = "DROP TABLE IF EXISTS timetb"
+load_manifest_table_drop = "DROP TABLE IF EXISTS load_manifest"
+load_progress_table_drop = "DROP TABLE IF EXISTS load_progress"
+unresolved_plays_table_drop = "DROP TABLE IF EXISTS unresolved_plays"
+plays_by_hour_tier_table_drop = "DROP TABLE IF EXISTS plays_by_hour_tier"
+plays_by_track_day_table_drop = "DROP TABLE IF EXISTS plays_by_track_day"
+plays_by_user_day_table_drop = "DROP TABLE IF EXISTS plays_by_user_day"
 
 # Insert records
 # trackplays
@@ -77,10 +253,11 @@ trackplays_table_insert = ("""
         track_id,
         artist_id,
         session_id,
+        item_in_session,
         location,
         user_agent
     )
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     ON CONFLICT (trackplay_id) DO NOTHING;
 """)
 
@@ -138,16 +315,441 @@ timetb_table_insert = ("""
     ON CONFLICT (start_time) DO NOTHING;
 """)
 
-# Query for track search
-track_search = ("""
-    SELECT tracks.track_id AS track_id, tracks.artist_id as artist_id
+# unresolved_plays
+unresolved_plays_table_insert = ("""
+    INSERT INTO unresolved_plays(
+        trackplay_id,
+        song,
+        artist,
+        length
+    )
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (trackplay_id) DO NOTHING;
+""")
+
+# Bulk loading
+# Each DataFrame is streamed into a temporary staging table with COPY
+# and merged into its target table with one set-based INSERT ... SELECT.
+# Integer columns are staged as numeric so that pandas float output
+# (e.g. 2000.0 for a column holding NULLs) is accepted by COPY.
+trackplays_stage_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS trackplays_stage
+    (trackplay_id numeric,
+     start_time timestamp,
+     user_id numeric,
+     tier text,
+     track_id text,
+     artist_id text,
+     session_id numeric,
+     item_in_session numeric,
+     location text,
+     user_agent text
+     )
+""")
+
+users_stage_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS users_stage
+    (user_id numeric,
+     first_name text,
+     last_name text,
+     gender text,
+     tier text
+     )
+""")
+
+tracks_stage_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS tracks_stage
+    (track_id text,
+     title text,
+     artist_id text,
+     year numeric,
+     duration numeric
+     )
+""")
+
+artists_stage_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS artists_stage
+    (artist_id text,
+     name text,
+     location text,
+     latitude numeric,
+     longitude numeric
+     )
+""")
+
+timetb_stage_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS timetb_stage
+    (start_time timestamp,
+     hour numeric,
+     day numeric,
+     week numeric,
+     month numeric,
+     year numeric,
+     weekday text
+     )
+""")
+
+unresolved_plays_stage_create = ("""
+    CREATE TEMP TABLE IF NOT EXISTS unresolved_plays_stage
+    (trackplay_id numeric,
+     song text,
+     artist text,
+     length numeric
+     )
+""")
+
+stage_truncate = "TRUNCATE {}_stage"
+
+stage_copy = "COPY {}_stage FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+# Merge staged records, same conflict handling as the inserts above
+trackplays_stage_merge = ("""
+    INSERT INTO trackplays(
+        trackplay_id,
+        start_time,
+        user_id,
+        tier,
+        track_id,
+        artist_id,
+        session_id,
+        item_in_session,
+        location,
+        user_agent
+    )
+    SELECT trackplay_id, start_time, user_id, tier, track_id,
+        artist_id, session_id, item_in_session, location, user_agent
+    FROM trackplays_stage
+    ON CONFLICT (trackplay_id) DO NOTHING;
+""")
+
+users_stage_merge = ("""
+    INSERT INTO users(
+        user_id,
+        first_name,
+        last_name,
+        gender,
+        tier
+    )
+    SELECT user_id, first_name, last_name, gender, tier
+    FROM users_stage
+    ON CONFLICT (user_id) DO NOTHING;
+""")
+
+tracks_stage_merge = ("""
+    INSERT INTO tracks(
+        track_id,
+        title,
+        artist_id,
+        year,
+        duration
+    )
+    SELECT track_id, title, artist_id, year, duration
+    FROM tracks_stage
+    ON CONFLICT (track_id) DO NOTHING;
+""")
+
+artists_stage_merge = ("""
+    INSERT INTO artists(
+        artist_id,
+        name,
+        location,
+        latitude,
+        longitude
+    )
+    SELECT artist_id, name, location, latitude, longitude
+    FROM artists_stage
+    ON CONFLICT (artist_id) DO NOTHING;
+""")
+
+timetb_stage_merge = ("""
+    INSERT INTO timetb(
+        start_time,
+        hour,
+        day,
+        week,
+        month,
+        year,
+        weekday
+    )
+    SELECT start_time, hour, day, week, month, year, weekday
+    FROM timetb_stage
+    ON CONFLICT (start_time) DO NOTHING;
+""")
+
+unresolved_plays_stage_merge = ("""
+    INSERT INTO unresolved_plays(
+        trackplay_id,
+        song,
+        artist,
+        length
+    )
+    SELECT trackplay_id, song, artist, length
+    FROM unresolved_plays_stage
+    ON CONFLICT (trackplay_id) DO NOTHING;
+""")
+
+# Reconciliation of unresolved plays, one chunk of
+# unresolved_plays at a time in trackplay_id order
+unresolved_chunk_end = ("""
+    SELECT max(trackplay_id) FROM (
+        SELECT trackplay_id FROM unresolved_plays
+        WHERE trackplay_id >= %s
+        ORDER BY trackplay_id
+        LIMIT %s
+    ) chunk
+""")
+
+unresolved_count = "SELECT count(*) FROM unresolved_plays"
+
+# Plays of the chunk whose track now exists
+trackplays_reconcile = ("""
+    UPDATE trackplays
+    SET track_id = matched.track_id,
+        artist_id = matched.artist_id
+    FROM (
+        SELECT u.trackplay_id, t.track_id, t.artist_id
+        FROM unresolved_plays u
+        JOIN tracks t ON t.title = u.song AND t.duration = u.length
+        JOIN artists a ON a.artist_id = t.artist_id AND a.name = u.artist
+        WHERE u.trackplay_id >= %s AND u.trackplay_id <= %s
+    ) matched
+    WHERE trackplays.trackplay_id = matched.trackplay_id
+    AND trackplays.track_id IS NULL
+""")
+
+# Newly resolved plays of the chunk, counted as plays_by_track_day deltas
+reconciled_plays_by_track_day = ("""
+    SELECT tp.track_id, tp.start_time::date, count(*)
+    FROM trackplays tp
+    JOIN unresolved_plays u ON u.trackplay_id = tp.trackplay_id
+    WHERE u.trackplay_id >= %s AND u.trackplay_id <= %s
+    AND tp.track_id IS NOT NULL AND tp.start_time IS NOT NULL
+    GROUP BY 1, 2
+""")
+
+unresolved_plays_delete = ("""
+    DELETE FROM unresolved_plays
+    WHERE trackplay_id >= %s AND trackplay_id <= %s
+    AND trackplay_id IN (
+        SELECT trackplay_id FROM trackplays
+        WHERE trackplay_id >= %s AND trackplay_id <= %s
+        AND track_id IS NOT NULL
+    )
+""")
+
+# Partitions of trackplays
+# The granularity (month or day) is kept as the comment of the
+# partitioned table, no row is returned if trackplays is not partitioned
+trackplays_partitioning_comment = "COMMENT ON TABLE trackplays IS %s"
+
+trackplays_partitioning_select = ("""
+    SELECT obj_description(c.oid, 'pg_class')
+    FROM pg_partitioned_table p
+    JOIN pg_class c ON c.oid = p.partrelid
+    WHERE c.relname = 'trackplays'
+""")
+
+trackplays_partitions_select = ("""
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_class parent ON parent.oid = i.inhparent
+    WHERE parent.relname = 'trackplays'
+""")
+
+trackplays_partition_create = ("""
+    CREATE TABLE IF NOT EXISTS {} PARTITION OF trackplays
+    FOR VALUES FROM (%s) TO (%s)
+""")
+
+# Merge of the staged plays of one partition directly into it
+trackplays_partition_merge = ("""
+    INSERT INTO {}(
+        trackplay_id,
+        start_time,
+        user_id,
+        tier,
+        track_id,
+        artist_id,
+        session_id,
+        item_in_session,
+        location,
+        user_agent
+    )
+    SELECT trackplay_id, start_time, user_id, tier, track_id,
+        artist_id, session_id, item_in_session, location, user_agent
+    FROM trackplays_stage
+    WHERE start_time >= %s AND start_time < %s
+    ON CONFLICT (trackplay_id, start_time) DO NOTHING;
+""")
+
+trackplays_partition_detach = "ALTER TABLE trackplays DETACH PARTITION {}"
+
+trackplays_partition_drop = "DROP TABLE {}"
+
+# Plays of a partition about to be dropped can no longer be resolved
+unresolved_plays_partition_delete = ("""
+    DELETE FROM unresolved_plays
+    WHERE trackplay_id IN (SELECT trackplay_id FROM {})
+""")
+
+# Load manifest
+load_manifest_select = ("""
+    SELECT file_path, file_size, file_mtime, content_hash
+    FROM load_manifest
+""")
+
+load_manifest_upsert = ("""
+    INSERT INTO load_manifest(
+        file_path,
+        file_size,
+        file_mtime,
+        content_hash,
+        row_counts
+    )
+    VALUES %s
+    ON CONFLICT (file_path) DO UPDATE SET
+        file_size = EXCLUDED.file_size,
+        file_mtime = EXCLUDED.file_mtime,
+        content_hash = EXCLUDED.content_hash,
+        row_counts = EXCLUDED.row_counts,
+        loaded_at = now();
+""")
+
+load_progress_select = ("""
+    SELECT file_path, range_start, range_end, file_size, file_mtime, row_counts
+    FROM load_progress
+""")
+
+load_progress_upsert = ("""
+    INSERT INTO load_progress(
+        file_path,
+        range_start,
+        range_end,
+        file_size,
+        file_mtime,
+        row_counts
+    )
+    VALUES %s
+    ON CONFLICT (file_path, range_start) DO UPDATE SET
+        range_end = EXCLUDED.range_end,
+        file_size = EXCLUDED.file_size,
+        file_mtime = EXCLUDED.file_mtime,
+        row_counts = EXCLUDED.row_counts;
+""")
+
+# Run when the whole file is recorded in the manifest
+load_progress_delete = "DELETE FROM load_progress WHERE file_path = %s"
+
+# mtime of a file touched since it was loaded, its contents unchanged
+load_manifest_touch = "UPDATE load_manifest SET file_mtime = %s WHERE file_path = %s"
+
+# Play count aggregates
+# Deltas of newly loaded plays are added to the stored counts
+plays_by_hour_tier_upsert = ("""
+    INSERT INTO plays_by_hour_tier(hour, tier, plays)
+    VALUES %s
+    ON CONFLICT (hour, tier) DO UPDATE SET
+        plays = plays_by_hour_tier.plays + EXCLUDED.plays;
+""")
+
+plays_by_track_day_upsert = ("""
+    INSERT INTO plays_by_track_day(track_id, day, plays)
+    VALUES %s
+    ON CONFLICT (track_id, day) DO UPDATE SET
+        plays = plays_by_track_day.plays + EXCLUDED.plays;
+""")
+
+plays_by_user_day_upsert = ("""
+    INSERT INTO plays_by_user_day(user_id, day, plays)
+    VALUES %s
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        plays = plays_by_user_day.plays + EXCLUDED.plays;
+""")
+
+# Rebuilds from the fact table, run after emptying the aggregate
+aggregate_delete = "DELETE FROM {}"
+
+plays_by_hour_tier_rebuild = ("""
+    INSERT INTO plays_by_hour_tier(hour, tier, plays)
+    SELECT date_trunc('hour', start_time), coalesce(tier, ''), count(*)
+    FROM trackplays
+    WHERE start_time IS NOT NULL
+    GROUP BY 1, 2
+""")
+
+plays_by_track_day_rebuild = ("""
+    INSERT INTO plays_by_track_day(track_id, day, plays)
+    SELECT track_id, start_time::date, count(*)
+    FROM trackplays
+    WHERE track_id IS NOT NULL AND start_time IS NOT NULL
+    GROUP BY 1, 2
+""")
+
+plays_by_user_day_rebuild = ("""
+    INSERT INTO plays_by_user_day(user_id, day, plays)
+    SELECT user_id, start_time::date, count(*)
+    FROM trackplays
+    WHERE start_time IS NOT NULL
+    GROUP BY 1, 2
+""")
+
+# Query for loading all tracks into the in-memory track index
+track_index_select = ("""
+    SELECT tracks.title, artists.name, tracks.duration,
+    tracks.track_id, tracks.artist_id
     FROM tracks JOIN artists ON tracks.artist_id = artists.artist_id
-    WHERE tracks.title = %s AND
-    artists.name = %s AND
-    tracks.duration = %s
 """)
 
+# Queries for seeding the dimension key cache
+dimension_key_selects = {
+    'users': "SELECT user_id FROM users",
+    'timetb': "SELECT start_time FROM timetb",
+    'artists': "SELECT artist_id FROM artists",
+    'tracks': "SELECT track_id FROM tracks"
+}
+
 # Query lists
-create_table_queries = [timetb_table_create, users_table_create, artists_table_create, tracks_table_create, trackplays_table_create]
+create_table_queries = [timetb_table_create, users_table_create, artists_table_create, tracks_table_create, trackplays_table_create, load_manifest_table_create, load_progress_table_create, unresolved_plays_table_create, plays_by_hour_tier_table_create, plays_by_track_day_table_create, plays_by_user_day_table_create]
+
+drop_table_queries = [trackplays_table_drop, users_table_drop, tracks_table_drop, artists_table_drop, timetb_table_drop, load_manifest_table_drop, load_progress_table_drop, unresolved_plays_table_drop, plays_by_hour_tier_table_drop, plays_by_track_day_table_drop, plays_by_user_day_table_drop]
+
+# Aggregate tables with their create, delta upsert and rebuild queries
+aggregate_queries = {
+    'plays_by_hour_tier': (plays_by_hour_tier_table_create, plays_by_hour_tier_upsert,
+                           plays_by_hour_tier_rebuild),
+    'plays_by_track_day': (plays_by_track_day_table_create, plays_by_track_day_upsert,
+                           plays_by_track_day_rebuild),
+    'plays_by_user_day': (plays_by_user_day_table_create, plays_by_user_day_upsert,
+                          plays_by_user_day_rebuild)
+}
+
+bulk_load_queries = {
+    'trackplays': (trackplays_stage_create, trackplays_stage_merge),
+    'users': (users_stage_create, users_stage_merge),
+    'tracks': (tracks_stage_create, tracks_stage_merge),
+    'artists': (artists_stage_create, artists_stage_merge),
+    'timetb': (timetb_stage_create, timetb_stage_merge),
+    'unresolved_plays': (unresolved_plays_stage_create, unresolved_plays_stage_merge)
+}
+
+
+# Columns of each loaded table, in the order of the insert queries
+table_columns = {
+    'trackplays': ['trackplay_id', 'start_time', 'user_id', 'tier', 'track_id',
+                   'artist_id', 'session_id', 'item_in_session', 'location', 'user_agent'],
+    'users': ['user_id', 'first_name', 'last_name', 'gender', 'tier'],
+    'tracks': ['track_id', 'title', 'artist_id', 'year', 'duration'],
+    'artists': ['artist_id', 'name', 'location', 'latitude', 'longitude'],
+    'timetb': ['start_time', 'hour', 'day', 'week', 'month', 'year', 'weekday'],
+    'unresolved_plays': ['trackplay_id', 'song', 'artist', 'length']
+}
 
-drop_table_queries = [trackplays_table_drop, users_table_drop, tracks_table_drop, artists_table_drop, timetb_table_drop]
+table_inserts = {
+    'trackplays': trackplays_table_insert,
+    'users': users_table_insert,
+    'tracks': tracks_table_insert,
+    'artists': artists_table_insert,
+    'timetb': timetb_table_insert,
+    'unresolved_plays': unresolved_plays_table_insert
+}
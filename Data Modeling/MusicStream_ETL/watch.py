@@ -0,0 +1,212 @@
+# Polling of the log directory for new and appended event files,
+# used by etl.py --watch
+
+import os
+import time
+import hashlib
+from readers import decode_json
+
+# Default seconds between polls of the log directory
+WATCH_POLL_INTERVAL = 1.0
+
+# Default maximum seconds new events wait to be loaded
+WATCH_FLUSH_INTERVAL = 5.0
+
+# Default number of new events that triggers a load
+WATCH_FLUSH_ROWS = 10000
+
+# Default seconds after which a file that stopped growing is no
+# longer checked on every poll, only on full rescans
+WATCH_IDLE_SECONDS = 300
+
+# Default seconds between full rescans of all directories and files
+WATCH_RESCAN_INTERVAL = 600
+
+class TailedFile:
+    '''
+    Read position in a log file that is loaded as it grows. Only
+    complete lines are read, a partially written last line is left
+    for the next read
+
+    Attributes:
+        path: filepath to log file
+        offset: bytes of the file already read
+        mtime: mtime of the file when it was last read
+        rows: number of events read from the file by this process
+    '''
+
+    def __init__(self, path, offset=0, loaded_hash=None):
+        self.path = path
+        self.offset = offset
+        self.mtime = None
+        self.rows = 0
+        self._loaded_hash = loaded_hash
+        self._md5 = None if offset else hashlib.md5()
+
+    def _resume(self, f):
+        '''
+        Hashes the part of the file loaded by an earlier run, and
+        starts over if it does not match the manifest
+        '''
+        md5 = hashlib.md5()
+        remaining = self.offset
+        while remaining:
+            block = f.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            md5.update(block)
+            remaining -= len(block)
+
+        if remaining or md5.hexdigest() != self._loaded_hash:
+            md5 = hashlib.md5()
+            self.offset = 0
+        self._md5 = md5
+
+    def read(self, stat):
+        '''
+        Reads the complete lines appended since the last read
+
+        Args:
+            stat: os.stat result for the file
+
+        Returns:
+            bytes of the new complete lines, possibly empty
+        '''
+        if stat.st_size < self.offset:
+            # Truncated or replaced, read it again from the start
+            self.offset = 0
+            self._md5 = hashlib.md5()
+
+        with open(self.path, 'rb') as f:
+            if self._md5 is None:
+                self._resume(f)
+            f.seek(self.offset)
+            content = f.read(stat.st_size - self.offset)
+
+        end = content.rfind(b'\n') + 1
+        # A last line without newline is complete once it decodes
+        # to an event, a partially written object never does
+        if content[end:].strip():
+            try:
+                if isinstance(decode_json(content[end:]), dict):
+                    end = len(content)
+            except ValueError:
+                pass
+        content = content[:end]
+
+        self.offset += len(content)
+        self.mtime = stat.st_mtime
+        self._md5.update(content)
+
+        return content
+
+    def info(self):
+        '''
+        Manifest fields of the part of the file read so far
+
+        Returns:
+            dict with path, size, mtime and content hash
+        '''
+        return {'path': self.path, 'size': self.offset,
+                'mtime': self.mtime, 'hash': self._md5.hexdigest()}
+
+
+class LogWatcher:
+    '''
+    Finds log files that are new or have grown since the last poll.
+    Directories are only listed when their mtime changes, and only
+    recently modified files are checked on every poll. All files
+    are checked on a full rescan
+
+    Attributes:
+        root: log data directory
+        idle_seconds: seconds after which a file that stopped
+            growing is only checked on full rescans
+        rescan_interval: seconds between full rescans
+    '''
+
+    def __init__(self, root, manifest, idle_seconds=WATCH_IDLE_SECONDS,
+                 rescan_interval=WATCH_RESCAN_INTERVAL):
+        self.root = root
+        self.idle_seconds = idle_seconds
+        self.rescan_interval = rescan_interval
+        self._manifest = manifest
+        self._dirs = {}
+        self._files = {}
+        self._active = set()
+        self._last_rescan = None
+
+    def _scan(self, directory, full):
+        '''
+        Adds the files of a directory tree that are not tracked yet,
+        listing only directories whose mtime changed unless full
+        '''
+        try:
+            mtime = os.stat(directory).st_mtime
+        except FileNotFoundError:
+            self._dirs.pop(directory, None)
+            return
+        listed = self._dirs.get(directory) == mtime and not full
+        self._dirs[directory] = mtime
+
+        if listed:
+            subdirs = [d for d in self._dirs if os.path.dirname(d) == directory]
+        else:
+            subdirs = []
+            for entry in os.scandir(directory):
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                # Compressed logs are finished archives, only plain ones are tailed
+                elif entry.name.endswith('.json'):
+                    self._track(os.path.abspath(entry.path))
+
+        for subdir in subdirs:
+            self._scan(subdir, full)
+
+    def _track(self, path):
+        '''
+        Starts tracking a file, from the part of it already in the manifest
+        '''
+        if path in self._files:
+            return
+
+        entry = self._manifest.get(path)
+        if entry is None:
+            self._files[path] = TailedFile(path)
+        else:
+            size, mtime, loaded_hash = entry
+            self._files[path] = TailedFile(path, size, loaded_hash)
+        self._active.add(path)
+
+    def poll(self):
+        '''
+        Reads the lines added to log files since the last poll,
+        one file at a time as the generator is consumed
+
+        Returns:
+            generator of (TailedFile, bytes of new complete lines) tuples
+        '''
+        now = time.time()
+        full = self._last_rescan is None or now - self._last_rescan >= self.rescan_interval
+        if full:
+            self._last_rescan = now
+        self._scan(self.root, full)
+
+        for path in sorted(self._files if full else self._active):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._files[path]
+                self._active.discard(path)
+                continue
+
+            tailed = self._files[path]
+            if stat.st_size == tailed.offset:
+                if now - stat.st_mtime > self.idle_seconds:
+                    self._active.discard(path)
+                continue
+
+            self._active.add(path)
+            content = tailed.read(stat)
+            if content:
+                yield tailed, content